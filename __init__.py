@@ -1,6 +1,8 @@
 import importlib
-from logging import getLogger, StreamHandler, Formatter, handlers, DEBUG
+import queue
+from logging import getLogger, StreamHandler, Formatter, handlers, WARNING
 import sys
+import time
 import bpy
 import os
 import datetime
@@ -22,45 +24,127 @@ bl_info = {
 }
 
 
-def setup_logger(log_folder: str, modname=__name__):
-    """loggerの設定をする"""
+# ログのフォーマットとファイル書き込みをするバックグラウンドスレッド
+_listener: handlers.QueueListener = None
+
+
+def setup_logger(log_dir: str = "", level=WARNING, modname=__name__):
+    """
+    loggerの設定をする
+    UIスレッドではキューに積むだけにして、フォーマットとファイル書き込みはQueueListenerのスレッドでやる
+    log_dirが空ならファイルには書かない
+    """
+    global _listener
+    teardown_logger(modname)
     logger = getLogger(modname)
-    logger.setLevel(DEBUG)
-    # log重複回避　https://nigimitama.hatenablog.jp/entry/2021/01/27/084458
-    if not logger.hasHandlers():
-        sh = StreamHandler()
-        sh.setLevel(DEBUG)
-        formatter = Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-        sh.setFormatter(formatter)
-        logger.addHandler(sh)
-        fh = handlers.RotatingFileHandler(log_folder, maxBytes=500000, backupCount=2)
-        fh.setLevel(DEBUG)
+    logger.setLevel(level)
+    sh = StreamHandler()
+    formatter = Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sh.setFormatter(formatter)
+    outputs = [sh]
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        log_file = os.path.join(log_dir, f"{datetime.date.today()}.log")
+        fh = handlers.RotatingFileHandler(
+            log_file, maxBytes=500000, backupCount=2, delay=True
+        )
         fh_formatter = Formatter(
             "%(asctime)s - %(filename)s - %(name)s"
             " - %(lineno)d - %(levelname)s - %(message)s"
         )
         fh.setFormatter(fh_formatter)
-        logger.addHandler(fh)
+        outputs.append(fh)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(handlers.QueueHandler(log_queue))
+    _listener = handlers.QueueListener(log_queue, *outputs, respect_handler_level=True)
+    _listener.start()
     return logger
 
 
-# log周りの設定
-scripts_dir = os.path.dirname(os.path.abspath(__file__))
-log_folder = os.path.join(scripts_dir, f"{datetime.date.today()}.log")
-logger = setup_logger(log_folder, modname=__name__)
+def teardown_logger(modname=__name__):
+    """handlerを外してQueueListenerを止める 溜まっているログは書き出してから止まる"""
+    global _listener
+    logger = getLogger(modname)
+    # log重複回避　https://nigimitama.hatenablog.jp/entry/2021/01/27/084458
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def configure_logger(prefs=None):
+    """アドオン設定のレベルと出力先でloggerを設定し直す"""
+    if prefs is None:
+        addon = bpy.context.preferences.addons.get(__name__)
+        if addon is None:
+            return
+        prefs = addon.preferences
+    log_dir = bpy.path.abspath(prefs.log_dir) if prefs.log_dir else ""
+    setup_logger(log_dir, prefs.log_level, modname=__name__)
+
+
+def update_logger(self, context):
+    configure_logger(self)
+
+
+class ScatterGpencilPreferences(bpy.types.AddonPreferences):
+    bl_idname = __name__
+
+    log_level: bpy.props.EnumProperty(
+        name="log level",
+        items=(
+            ("DEBUG", "debug", ""),
+            ("INFO", "info", ""),
+            ("WARNING", "warning", ""),
+            ("ERROR", "error", ""),
+        ),
+        default="WARNING",
+        update=update_logger,
+    )
+    log_dir: bpy.props.StringProperty(
+        name="log directory",
+        default="",
+        subtype="DIR_PATH",
+        description="ログファイルを書き出すフォルダ 空ならファイルには書かない",
+        update=update_logger,
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "log_level")
+        layout.prop(self, "log_dir")
+        box = layout.box()
+        box.label(text="import / register (ms)")
+        for name in namespace:
+            row = box.row()
+            row.label(text=name)
+            row.label(text=f"{import_times.get(name, 0) * 1000:.1f}")
+            row.label(text=f"{register_times.get(name, 0) * 1000:.1f}")
+
+
+# log周りの設定 アドオン設定はregisterで読む
+logger = setup_logger(modname=__name__)
 logger.debug("hello")
 
 
 # サブモジュールのインポート
 module_names = get_module_name()
 namespace = {}
+# モジュール名 -> import(reload)/registerにかかった秒 アドオン設定に表示する
+import_times = {}
+register_times = {}
 for name in module_names:
     fullname = "{}.{}.{}".format(__package__, "lib", name)
+    start = time.perf_counter()
     # if "bpy" in locals():
     if fullname in sys.modules:
         namespace[name] = importlib.reload(sys.modules[fullname])
     else:
         namespace[name] = importlib.import_module(fullname)
+    import_times[name] = time.perf_counter() - start
 logger.debug(namespace)
 
 
@@ -81,8 +165,19 @@ def unregister_icons():
 
 
 def register():
-    for module in namespace.values():
+    bpy.utils.register_class(ScatterGpencilPreferences)
+    configure_logger()
+    for name, module in namespace.items():
+        start = time.perf_counter()
         module.register()
+        register_times[name] = time.perf_counter() - start
+    for name in namespace:
+        logger.debug(
+            "%s: import %.1fms register %.1fms",
+            name,
+            import_times.get(name, 0) * 1000,
+            register_times.get(name, 0) * 1000,
+        )
     # register_icons()
     logger.debug("succeeded register template addon")
 
@@ -91,6 +186,8 @@ def unregister():
     for module in namespace.values():
         module.unregister()
     # unregister_icons()
+    bpy.utils.unregister_class(ScatterGpencilPreferences)
+    teardown_logger(__name__)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,338 @@
+"""
+性能計測用スクリプト
+blender -b --python bench.py -- --output result.json --compare baseline.json
+bpyに依存しない部分だけなら python bench.py --output result.json でも動く
+"""
+import argparse
+import datetime
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+root = os.path.dirname(os.path.abspath(__file__))
+lib_dir = os.path.join(root, "lib")
+
+# lib/standalone.py自体もパッケージを経由せずに読む
+_spec = importlib.util.spec_from_file_location(
+    "standalone", os.path.join(lib_dir, "standalone.py")
+)
+standalone = importlib.util.module_from_spec(_spec)
+sys.modules["standalone"] = standalone
+_spec.loader.exec_module(standalone)
+
+
+def load_standalone(name: str):
+    """bpyに依存しないlib内のモジュールをパッケージを経由せずに読む"""
+    return standalone.load(name)
+
+
+def import_addon_module(name: str):
+    """アドオンのパッケージとしてlib内のモジュールを読む Blender内のみ"""
+    parent, package = os.path.split(root)
+    if parent not in sys.path:
+        sys.path.append(parent)
+    return importlib.import_module(f"{package}.lib.{name}")
+
+
+def measure(func, repeat: int = 5) -> list:
+    """funcをrepeat回実行して秒のリストを返す"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times: list, points: int = 0) -> dict:
+    median = statistics.median(times)
+    result = {"seconds": median, "min": min(times), "max": max(times)}
+    if points:
+        result["points_per_sec"] = points / median if median else 0.0
+    return result
+
+
+# bpyに依存しない計測
+
+
+def bench_offsets(results: dict):
+    core = load_standalone("scatter_core")
+    rng = core.get_rng(0)
+    count = 100000
+    for distribution, _, _ in core.DISTRIBUTIONS:
+        times = measure(lambda: core.generate_offsets(distribution, count, 1.0, rng))
+        results[f"offsets/{distribution}"] = summarize(times, count)
+
+
+def bench_rng_pool(results: dict):
+    """ティックの間隔を空けて呼んだときのメインスレッド側の時間 Generatorと比べる"""
+    core = load_standalone("scatter_core")
+    pool = load_standalone("rng_pool").RandomPool()
+    count = 10000
+    for name, rng in (("generator", core.get_rng(0)), ("pool", pool)):
+        times = []
+        for _ in range(50):
+            times += measure(lambda: rng.normal(0, 0.1, (count, 3)), repeat=1)
+            time.sleep(0.005)
+        results[f"rng/{name}"] = summarize(times, count)
+    pool.stop()
+
+
+def bench_resample(results: dict):
+    core = load_standalone("scatter_core")
+    rng = core.get_rng(0)
+    guide = rng.normal(0, 1, (10000, 3)).cumsum(axis=0)
+    pressures = rng.uniform(0, 1, 10000)
+    times = measure(lambda: core.resample_polyline(guide, pressures, 0.05, 0.0))
+    centers, _, _ = core.resample_polyline(guide, pressures, 0.05, 0.0)
+    results["resample_polyline"] = summarize(times, len(centers))
+
+
+def bench_stamps(results: dict):
+    """1ティック分のスタンプ配置 点ごとに生成するのとの比較用"""
+    core = load_standalone("scatter_core")
+    rng = core.get_rng(0)
+    bank = core.procedural_stamp_bank("GAUSS", 32, 8)
+    for stamps in (1, 10, 100):
+        centers = rng.normal(0, 1, (stamps, 3))
+
+        def place():
+            matrices = core.stamp_matrices(stamps, rng, 0.2, 0.3, (0.0, 0.0, 1.0))
+            bank.place(rng.integers(0, len(bank), stamps), centers, matrices)
+
+        times = measure(place, repeat=20)
+        results[f"stamps/{stamps}x32"] = summarize(times, stamps * 32)
+
+
+def bench_spatial_hash(results: dict):
+    core = load_standalone("scatter_core")
+    points = core.generate_offsets("GAUSS", 20000, 1.0, core.get_rng(0))
+    times = measure(lambda: core.SpatialHash(0.01).insert(points), repeat=3)
+    results["spatial_hash/insert"] = summarize(times, len(points))
+
+    # 1tickぶん(1000点)ずつ、すでに点が溜まっているところへ追加する
+    spatial_hash = core.SpatialHash(0.01)
+    batches = [
+        core.generate_offsets("GAUSS", 1000, 1.0, core.get_rng(seed))
+        for seed in range(40)
+    ]
+    for batch in batches[:20]:
+        spatial_hash.insert(batch)
+    batches = iter(batches[20:])
+    times = measure(lambda: spatial_hash.insert(next(batches)), repeat=20)
+    results["spatial_hash/insert_tick"] = summarize(times, 1000)
+
+
+def bench_color_reduction(results: dict):
+    import numpy as np
+
+    color = load_standalone("color_core")
+    rng = np.random.default_rng(0)
+    for size in (3, 9, 33, 64, 128):
+        pixels = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+        for method, _, _ in color.REDUCTIONS:
+            times = measure(lambda: color.reduce_colors(pixels, method), repeat=20)
+            results[f"reduce_colors/{method}/{size}"] = summarize(times)
+
+
+def bench_palette(results: dict):
+    import numpy as np
+
+    color = load_standalone("color_core")
+    rng = np.random.default_rng(0)
+    pixels = rng.random((540, 960, 4))
+    times = measure(lambda: color.kmeans(pixels, 8), repeat=3)
+    results["kmeans/960x540/8"] = summarize(times, 960 * 540)
+    lut = color.ColorLUT(rng.random((16, 3)))
+    colors = rng.random((100000, 4))
+    times = measure(lambda: lut.lookup(colors), repeat=20)
+    results["color_lut/lookup"] = summarize(times, len(colors))
+
+
+# Blender内だけの計測
+
+
+def new_gpencil(name: str = "bench"):
+    gp_data = bpy.data.grease_pencils.new(name)
+    layer = gp_data.layers.new("bench")
+    frame = layer.frames.new(1)
+    return gp_data, frame
+
+
+def bench_tick(results: dict):
+    """ScatterGpencilOpsの1ドロー分(生成 変換 書き込み)をセッション分くり返す"""
+    import numpy as np
+
+    ops = import_addon_module("ops_scatter_gpencil")
+    core = ops.scatter_core
+    rng = core.get_rng(0)
+    matrix = np.eye(4)
+    ticks = 300
+    for count in (10, 100, 1000):
+        for limit in (0, 2000):
+            gp_data, frame = new_gpencil()
+            writer = ops.StrokeWriter(frame.strokes.new())
+            tick_times = []
+            for _ in range(ticks):
+                start = time.perf_counter()
+                if limit and len(writer) >= limit:
+                    writer = ops.StrokeWriter(frame.strokes.new())
+                offsets = core.generate_offsets("GAUSS", count, 0.5, rng)
+                co = core.transform_points(matrix, offsets)
+                writer.append(co, np.ones(count), np.ones(count))
+                tick_times.append(time.perf_counter() - start)
+            bpy.data.grease_pencils.remove(gp_data)
+            total = sum(tick_times)
+            tick_times.sort()
+            results[f"tick/count{count}/limit{limit}"] = {
+                "seconds": total,
+                "points_per_sec": count * ticks / total,
+                "tick_p50": tick_times[len(tick_times) // 2],
+                "tick_p95": tick_times[int(len(tick_times) * 0.95)],
+                "tick_max": tick_times[-1],
+            }
+
+
+def bench_points_add(results: dict):
+    """ストロークの長さごとのpoints.add(10)のコスト"""
+    for length in (100, 1000, 10000, 100000):
+        gp_data, frame = new_gpencil()
+        stroke = frame.strokes.new()
+        stroke.points.add(length)
+        times = measure(lambda: stroke.points.add(10), repeat=20)
+        bpy.data.grease_pencils.remove(gp_data)
+        results[f"points_add/{length}"] = summarize(times)
+
+
+def bench_capture(results: dict):
+    """GLのコンテキストが必要なのでバックグラウンドでは計らない"""
+    if bpy.app.background:
+        return
+    capture = import_addon_module("ops_capture_color")
+    for size in (3, 9, 33, 64):
+        buffer = capture.get_buffer(size)
+        times = measure(
+            lambda: capture.average_color(
+                capture.capture_under_cursor(buffer, 100, 100, size, "f")
+            ),
+            repeat=20,
+        )
+        results[f"capture_under_cursor/{size}"] = summarize(times)
+
+
+def bench_gp_licker(results: dict):
+    util = import_addon_module("util")
+    gp_data = bpy.data.grease_pencils.new("bench")
+    state = {"layers": []}
+    for li in range(10):
+        layer = gp_data.layers.new(f"bench{li}")
+        layer_state = {"frames": []}
+        for fi in range(10):
+            frame = layer.frames.new(fi + 1)
+            for _ in range(100):
+                frame.strokes.new().points.add(10)
+            layer_state["frames"].append({"strokes": [{} for _ in range(100)]})
+        state["layers"].append(layer_state)
+    times = measure(lambda: util.gp_licker(gp_data, lambda *args: None, state))
+    bpy.data.grease_pencils.remove(gp_data)
+    results["gp_licker/10x10x100"] = summarize(times, 10 * 10 * 100)
+
+
+def bench_gp_snapshot(results: dict):
+    snapshot = import_addon_module("gp_snapshot")
+    gp_data = bpy.data.grease_pencils.new("bench")
+    for li in range(10):
+        layer = gp_data.layers.new(f"bench{li}")
+        for fi in range(10):
+            frame = layer.frames.new(fi + 1)
+            for _ in range(100):
+                frame.strokes.new().points.add(10)
+    times = measure(lambda: snapshot.snapshot(gp_data))
+    results["gp_snapshot/10x10x100"] = summarize(times, 10 * 10 * 100 * 10)
+    data = snapshot.snapshot(gp_data)
+    times = measure(lambda: snapshot.restore(gp_data, data))
+    bpy.data.grease_pencils.remove(gp_data)
+    results["gp_restore/10x10x100"] = summarize(times, 10 * 10 * 100 * 10)
+
+
+def run() -> dict:
+    results = {}
+    benches = [
+        bench_offsets,
+        bench_rng_pool,
+        bench_resample,
+        bench_stamps,
+        bench_spatial_hash,
+        bench_color_reduction,
+        bench_palette,
+    ]
+    if bpy is not None:
+        benches += [bench_tick, bench_points_add, bench_capture, bench_gp_licker]
+        benches += [bench_gp_snapshot]
+    for bench in benches:
+        print(f"running {bench.__name__}", file=sys.stderr)
+        bench(results)
+    return {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "blender": bpy.app.version_string if bpy is not None else None,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """baselineよりthreshold倍以上遅くなった計測の名前を返す"""
+    regressions = []
+    for name, result in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None or not base["seconds"]:
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        mark = ""
+        if ratio > threshold:
+            mark = "  <-- regression"
+            regressions.append(name)
+        print(f"{name:40s} {base['seconds']:.6f} -> {result['seconds']:.6f} x{ratio:.2f}{mark}")
+    return regressions
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="gpencil-scatter benchmark")
+    parser.add_argument("--output", help="結果を書き出すjsonのパス")
+    parser.add_argument("--compare", help="比較するベースラインのjsonのパス")
+    parser.add_argument(
+        "--threshold", type=float, default=1.2, help="この倍率より遅くなったら失敗にする"
+    )
+    args = parser.parse_args(argv)
+
+    current = run()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    else:
+        print(json.dumps(current, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            sys.exit(1)
+
+
+# blender -b --python bench.py -- 以降の引数だけを使う
+if "--" in sys.argv:
+    main(sys.argv[sys.argv.index("--") + 1 :])
+else:
+    main(sys.argv[1:] if bpy is None else [])
@@ -4,7 +4,13 @@ _module_names = [
     "ops_capture_color",
     # "ui_template",
     # "translations",
+    "surface_cache",
+    "image_cache",
     "ops_scatter_gpencil",
+    "ops_scatter_bulk",
+    "ops_scatter_frames",
+    "ops_stroke_library",
+    "ops_decimate_gpencil",
 ]
 
 
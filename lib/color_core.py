@@ -0,0 +1,165 @@
+"""
+色のサンプル結果を集計する計算だけを集めたモジュール
+bpy/bglに依存しないのでBlender外(素のCPython)でもimportして使える
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+
+try:
+    from .standalone import lazy_import
+except ImportError:
+    # パッケージを経由せずにトップレベルのモジュールとして読まれたとき
+    from standalone import lazy_import
+
+# アドオンの読み込みを軽くするためnumpyは最初に使うときに読み込む
+np = lazy_import("numpy")
+
+# (identifier, name, description) EnumPropertyのitemsにもそのまま使う
+REDUCTIONS = (
+    ("MEAN", "mean", "平均"),
+    ("MEDIAN", "median", "中央値 ノイズや境界に強い"),
+    ("WEIGHTED", "weighted", "中心ほど重いガウス重み付き平均"),
+)
+
+
+@lru_cache(maxsize=16)
+def gaussian_weights(height: int, width: int) -> np.ndarray:
+    """カーネル中心ほど重い(height, width)の重み 合計は1"""
+    y = np.arange(height) - (height - 1) / 2
+    x = np.arange(width) - (width - 1) / 2
+    # カーネルの端で中心の1/e^2くらいになるようにする
+    sigma = max(height, width) / 4 or 1
+    weights = np.exp(-(y[:, None] ** 2 + x[None, :] ** 2) / (2 * sigma * sigma))
+    weights /= weights.sum()
+    weights.flags.writeable = False
+    return weights
+
+
+def reduce_colors(pixels: np.ndarray, method: str = "MEAN") -> np.ndarray:
+    """
+    (height, width, 4)か(N, 4)かフラットなRGBAのピクセルを1色にまとめる
+    WEIGHTEDは(height, width, 4)のときだけ中心重みになる それ以外は平均
+    """
+    pixels = np.asarray(pixels)
+    if pixels.ndim == 1:
+        pixels = pixels.reshape(-1, 4)
+    if method == "WEIGHTED" and pixels.ndim == 3:
+        weights = gaussian_weights(pixels.shape[0], pixels.shape[1])
+        return np.tensordot(weights, pixels, axes=([0, 1], [0, 1]))
+    flat = pixels.reshape(-1, pixels.shape[-1])
+    if method == "MEDIAN":
+        return np.median(flat, axis=0)
+    return flat.mean(axis=0)
+
+
+def sample_image(pixels: np.ndarray, uv: np.ndarray) -> np.ndarray:
+    """
+    (height, width, C)の画像からuv(N, 2)(0~1 左下原点)の位置の色をまとめて拾う
+    範囲外は端の色になる 最近傍
+    """
+    height, width = pixels.shape[:2]
+    uv = np.asarray(uv, dtype=np.float64).reshape(-1, 2)
+    x = np.clip((uv[:, 0] * width).astype(np.int64), 0, width - 1)
+    y = np.clip((uv[:, 1] * height).astype(np.int64), 0, height - 1)
+    return pixels[y, x]
+
+
+def luminance(colors: np.ndarray) -> np.ndarray:
+    """RGBA(N, 4)を輝度(N,)にする アルファも掛ける"""
+    colors = np.asarray(colors, dtype=np.float64).reshape(-1, 4)
+    return (colors[:, :3] @ np.array([0.2126, 0.7152, 0.0722])) * colors[:, 3]
+
+
+def linear_to_srgb(colors: np.ndarray) -> np.ndarray:
+    """リニアのRGB(...,3)をsRGBにする マテリアルの色をキャプチャした色とそろえる用"""
+    colors = np.clip(np.asarray(colors, dtype=np.float64), 0, 1)
+    return np.where(
+        colors <= 0.0031308, colors * 12.92, 1.055 * colors ** (1 / 2.4) - 0.055
+    )
+
+
+def srgb_to_linear(colors: np.ndarray) -> np.ndarray:
+    """sRGBのRGB(...,3)をリニアにする キャプチャした色をvertex_colorに書く用"""
+    colors = np.clip(np.asarray(colors, dtype=np.float64), 0, 1)
+    return np.where(
+        colors <= 0.04045, colors / 12.92, ((colors + 0.055) / 1.055) ** 2.4
+    )
+
+
+def _squared_distances(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """(N, 3)と(K, 3)の全組み合わせの二乗距離(N, K) 差の配列(N, K, 3)を作らないで済ませる"""
+    return (
+        (points * points).sum(axis=1)[:, None]
+        - 2 * points @ centers.T
+        + (centers * centers).sum(axis=1)[None, :]
+    )
+
+
+def kmeans(
+    colors: np.ndarray,
+    k: int,
+    iterations: int = 20,
+    rng: np.random.Generator = None,
+    max_samples: int = 20000,
+):
+    """
+    RGB(A)の色をk色に減色する (パレット(k, 3), 各パレットの色に属するサンプル数(k,))を返す
+    色が多いときはmax_samples個だけ使う 全部の色に番号を付けると(N, k)の距離で
+    メモリが足りなくなるので数もサンプルで数える
+    """
+    colors = np.asarray(colors)
+    colors = colors.reshape(-1, colors.shape[-1])[:, :3]
+    if rng is None:
+        rng = np.random.default_rng(0)
+    samples = colors
+    if len(samples) > max_samples:
+        samples = samples[rng.choice(len(samples), max_samples, replace=False)]
+    # float64にするのはサンプルだけにして全ピクセルのコピーを作らない
+    samples = samples.astype(np.float64)
+    unique = np.unique(samples, axis=0)
+    k = max(1, min(k, len(unique)))
+    centers = unique[rng.choice(len(unique), k, replace=False)]
+    for _ in range(iterations):
+        labels = _squared_distances(samples, centers).argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack(
+            [np.bincount(labels, weights=samples[:, c], minlength=k) for c in range(3)],
+            axis=1,
+        )
+        # 点がなくなったクラスタは前の中心のままにする
+        filled = counts > 0
+        new_centers = centers.copy()
+        new_centers[filled] = sums[filled] / counts[filled, None]
+        if np.allclose(new_centers, centers):
+            centers = new_centers
+            break
+        centers = new_centers
+    labels = _squared_distances(samples, centers).argmin(axis=1)
+    return centers, np.bincount(labels, minlength=len(centers))
+
+
+class ColorLUT:
+    """
+    RGB(0~1)をresolution^3の格子に区切り、各格子に一番近いパレットの番号を入れておく
+    引くときは格子を見るだけなのでパレットの数によらない
+    """
+
+    def __init__(self, palette: np.ndarray, resolution: int = 32):
+        palette = np.asarray(palette, dtype=np.float64).reshape(len(palette), -1)
+        if len(palette) == 0:
+            raise ValueError("empty palette")
+        self.palette = palette[:, :3]
+        self.resolution = resolution
+        grid = (np.arange(resolution) + 0.5) / resolution
+        cells = np.stack(np.meshgrid(grid, grid, grid, indexing="ij"), axis=-1)
+        nearest = _squared_distances(cells.reshape(-1, 3), self.palette).argmin(axis=1)
+        self.table = nearest.reshape(resolution, resolution, resolution)
+
+    def lookup(self, colors: np.ndarray) -> np.ndarray:
+        """色(N, 3か4)のパレット番号(N,)をまとめて引く"""
+        colors = np.asarray(colors).reshape(-1, np.shape(colors)[-1])
+        index = np.clip(
+            (colors[:, :3] * self.resolution).astype(np.int64), 0, self.resolution - 1
+        )
+        return self.table[index[:, 0], index[:, 1], index[:, 2]]
@@ -0,0 +1,298 @@
+"""
+GPのストロークとポイントの属性を列ごとのnumpy配列にまとめて取り出す/書き戻す
+gp_lickerのように要素ごとに関数を呼ばずにforeach_get/foreach_setで読み書きする
+
+スナップショットは次のキーを持つdict
+    layers: レイヤー名(layer.info)のリスト
+    frame_layer, frame_number: フレームごとのlayersのインデックスとフレーム番号
+    frame_offsets: フレームごとのストロークの範囲 (フレーム数+1,)
+    stroke_offsets: ストロークごとのポイントの範囲 (ストローク数+1,)
+    STROKE_ATTRIBUTESとPOINT_ATTRIBUTESの各属性
+"""
+from __future__ import annotations
+
+import bpy
+from logging import getLogger
+from .standalone import lazy_import
+from .util import get_or_create_frame
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+# (属性名, 1要素あたりの値の数, dtype)
+STROKE_ATTRIBUTES = (
+    ("material_index", 1, "int32"),
+    ("line_width", 1, "int32"),
+)
+POINT_ATTRIBUTES = (
+    ("co", 3, "float32"),
+    ("pressure", 1, "float32"),
+    ("strength", 1, "float32"),
+    ("vertex_color", 4, "float32"),
+)
+# 書き出しには含めないが、その場でストロークを書き直すときには残したいポイントの属性
+EXTRA_POINT_ATTRIBUTES = (
+    ("select", 1, "bool"),
+    ("uv_factor", 1, "float32"),
+    ("uv_rotation", 1, "float32"),
+    ("uv_fill", 2, "float32"),
+)
+
+
+def _empty(count: int, size: int, dtype: str) -> np.ndarray:
+    return np.empty((count, size) if size > 1 else count, dtype=dtype)
+
+
+def _offsets(counts) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def point_attributes(data: dict) -> tuple:
+    """dataが持っているポイントの属性 EXTRA_POINT_ATTRIBUTESは読んだときだけある"""
+    return POINT_ATTRIBUTES + tuple(
+        attribute for attribute in EXTRA_POINT_ATTRIBUTES if attribute[0] in data
+    )
+
+
+def read_strokes(
+    strokes: bpy.types.GPencilStrokes, extra: bool = False, first: int = 0
+) -> dict:
+    """
+    ストロークのコレクションのfirst番目以降の属性とstroke_offsetsを返す
+    extraならEXTRA_POINT_ATTRIBUTESのうちこのBlenderにあるものも読む
+    """
+    attributes = POINT_ATTRIBUTES
+    if extra:
+        names = bpy.types.GPencilStrokePoint.bl_rna.properties.keys()
+        attributes += tuple(a for a in EXTRA_POINT_ATTRIBUTES if a[0] in names)
+    tail = strokes[first:] if first else strokes
+    counts = [len(stroke.points) for stroke in tail]
+    offsets = _offsets(counts)
+    data = {"stroke_offsets": offsets}
+    for name, size, dtype in STROKE_ATTRIBUTES:
+        # foreach_getはコレクション全体でしか使えないので全部読んでから切る
+        values = _empty(len(strokes), size, dtype)
+        strokes.foreach_get(name, values.ravel())
+        data[name] = values[first:]
+    total = int(offsets[-1])
+    for name, size, dtype in attributes:
+        data[name] = _empty(total, size, dtype)
+    # ポイントはストロークごとにしか読めないので配列の該当範囲に直接読み込む
+    flats = [(name, data[name].reshape(-1)) for name, _, _ in attributes]
+    sizes = [size for _, size, _ in attributes]
+    for stroke, start, end in zip(tail, offsets[:-1], offsets[1:]):
+        if start == end:
+            continue
+        points = stroke.points
+        for (name, flat), size in zip(flats, sizes):
+            points.foreach_get(name, flat[start * size : end * size])
+    return data
+
+
+def write_strokes(
+    strokes: bpy.types.GPencilStrokes,
+    data: dict,
+    first: int = 0,
+    last: int = None,
+    settings: list = None,
+    stroke_attributes: bool = True,
+) -> list:
+    """
+    dataのfirst番目からlast番目の手前までのストロークをコレクションの末尾に追加する
+    settings(stroke_settingsのリスト)を渡すとポイントを書く前に各ストロークに書き込む
+    stroke_attributesがFalseならSTROKE_ATTRIBUTESは書かないので後でwrite_stroke_attributesで書く
+    追加したストロークを返す
+    """
+    offsets = data["stroke_offsets"]
+    if last is None:
+        last = len(offsets) - 1
+    columns = [
+        (name, np.ascontiguousarray(data[name], dtype=dtype).reshape(-1), size)
+        for name, size, dtype in point_attributes(data)
+    ]
+    new_strokes = []
+    for i, (start, end) in enumerate(
+        zip(offsets[first:last], offsets[first + 1 : last + 1])
+    ):
+        stroke = strokes.new()
+        # ストロークのselectはポイントの選択も書き換えるのでポイントより先に書く
+        if settings is not None:
+            apply_stroke_settings(stroke, settings[i])
+        new_strokes.append(stroke)
+        if start == end:
+            continue
+        points = stroke.points
+        points.add(int(end - start))
+        for name, flat, size in columns:
+            points.foreach_set(name, flat[start * size : end * size])
+    if stroke_attributes:
+        write_stroke_attributes(strokes, data, first, last)
+    return new_strokes
+
+
+def write_stroke_attributes(
+    strokes: bpy.types.GPencilStrokes, data: dict, first: int = 0, last: int = None
+):
+    """
+    dataのfirst番目からlast番目の手前までのストロークのSTROKE_ATTRIBUTESを
+    コレクションの末尾の同じ数のストロークに書く
+    コレクション全体にしかforeach_setできないので今の値を読んでから末尾の分だけ書き換える
+    """
+    if last is None:
+        last = len(data["stroke_offsets"]) - 1
+    existing = len(strokes) - (last - first)
+    for name, size, dtype in STROKE_ATTRIBUTES:
+        values = np.empty(len(strokes) * size, dtype=dtype)
+        strokes.foreach_get(name, values)
+        values[existing * size :] = np.asarray(data[name][first:last]).ravel()
+        strokes.foreach_set(name, values)
+
+
+def snapshot(gp_data: bpy.types.GreasePencil, layers=None, frame_numbers=None) -> dict:
+    """
+    GPデータのスナップショットを返す
+    layers(レイヤー名)やframe_numbersを渡すとそれに含まれるものだけを取り出す
+    """
+    layer_names = []
+    frame_layer = []
+    frame_number = []
+    parts = []
+    for layer in gp_data.layers:
+        if layers is not None and layer.info not in layers:
+            continue
+        li = len(layer_names)
+        layer_names.append(layer.info)
+        for frame in layer.frames:
+            if frame_numbers is not None and frame.frame_number not in frame_numbers:
+                continue
+            frame_layer.append(li)
+            frame_number.append(frame.frame_number)
+            parts.append(read_strokes(frame.strokes))
+    data = concatenate(parts)
+    data["layers"] = layer_names
+    data["frame_layer"] = np.array(frame_layer, dtype=np.int32)
+    data["frame_number"] = np.array(frame_number, dtype=np.int32)
+    logger.debug(
+        "snapshot: %d frames %d strokes %d points",
+        len(parts),
+        len(data["stroke_offsets"]) - 1,
+        data["stroke_offsets"][-1],
+    )
+    return data
+
+
+def concatenate(parts: list) -> dict:
+    """read_strokesの結果を順につなげてframe_offsetsを付ける"""
+    data = {}
+    for name, size, dtype in STROKE_ATTRIBUTES + POINT_ATTRIBUTES:
+        if parts:
+            data[name] = np.concatenate([part[name] for part in parts])
+        else:
+            data[name] = _empty(0, size, dtype)
+    stroke_counts = [len(part["stroke_offsets"]) - 1 for part in parts]
+    point_counts = [np.diff(part["stroke_offsets"]) for part in parts]
+    data["frame_offsets"] = _offsets(stroke_counts)
+    data["stroke_offsets"] = _offsets(
+        np.concatenate(point_counts) if point_counts else []
+    )
+    return data
+
+
+def frame_strokes(data: dict, index: int) -> tuple:
+    """index番目のフレームのストロークの範囲(first, last)を返す"""
+    offsets = data["frame_offsets"]
+    return int(offsets[index]), int(offsets[index + 1])
+
+
+def restore(gp_data: bpy.types.GreasePencil, data: dict, clear: bool = True):
+    """
+    スナップショットをGPデータに書き戻す
+    レイヤーとフレームはなければ作る clearなら書き戻す前にフレームを空にする
+    """
+    for fi, (li, frame_number) in enumerate(
+        zip(data["frame_layer"], data["frame_number"])
+    ):
+        name = data["layers"][li]
+        layer = gp_data.layers.get(name)
+        if layer is None:
+            layer = gp_data.layers.new(name, set_active=False)
+        frame = get_or_create_frame(layer, int(frame_number))
+        if clear:
+            frame.clear()
+        first, last = frame_strokes(data, fi)
+        write_strokes(frame.strokes, data, first, last)
+
+
+def take_strokes(data: dict, mask) -> dict:
+    """maskがTrueのストロークだけを取り出す(frame系のキーは持たない)"""
+    counts = np.diff(data["stroke_offsets"])
+    mask = np.asarray(mask, dtype=bool)
+    point_mask = np.repeat(mask, counts)
+    result = {"stroke_offsets": _offsets(counts[mask])}
+    for name, _, _ in STROKE_ATTRIBUTES:
+        result[name] = data[name][mask]
+    for name, _, _ in point_attributes(data):
+        result[name] = data[name][point_mask]
+    return result
+
+
+def slice_strokes(data: dict, first: int, last: int) -> dict:
+    """
+    first番目からlast番目の手前までのストロークを取り出す
+    配列はスライスなのでmemmapから読んでいても必要な範囲しか読まれない
+    """
+    offsets = data["stroke_offsets"]
+    start, end = offsets[first], offsets[last]
+    result = {"stroke_offsets": offsets[first : last + 1] - start}
+    for name, _, _ in STROKE_ATTRIBUTES:
+        result[name] = data[name][first:last]
+    for name, _, _ in point_attributes(data):
+        result[name] = data[name][start:end]
+    return result
+
+
+def filter_points(data: dict, keep, drop_empty: bool = True) -> dict:
+    """
+    keepがTrueのポイントだけを残す
+    drop_emptyならポイントがなくなったストロークは消す Falseならストロークの並びはそのまま
+    """
+    offsets = data["stroke_offsets"]
+    keep = np.asarray(keep, dtype=bool)
+    owner = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    counts = np.bincount(owner[keep], minlength=len(offsets) - 1)
+    result = {"stroke_offsets": _offsets(counts)}
+    for name, _, _ in STROKE_ATTRIBUTES:
+        result[name] = data[name]
+    for name, _, _ in point_attributes(data):
+        result[name] = data[name][keep]
+    if not drop_empty:
+        return result
+    return take_strokes(result, counts > 0)
+
+
+def stroke_settings(stroke: bpy.types.GPencilStroke) -> dict:
+    """
+    ストロークの書き込めるプロパティ(ポイントなどのコレクションは除く)をすべて読む
+    hardnessやキャップ、UVなどSTROKE_ATTRIBUTESにないものも含む
+    """
+    settings = {}
+    for prop in stroke.bl_rna.properties:
+        if prop.is_readonly or prop.type in {"POINTER", "COLLECTION"}:
+            continue
+        value = getattr(stroke, prop.identifier)
+        if getattr(prop, "array_length", 0):
+            value = value[:]
+        settings[prop.identifier] = value
+    return settings
+
+
+def apply_stroke_settings(stroke: bpy.types.GPencilStroke, settings: dict):
+    """stroke_settingsで読んだ値を書き込む"""
+    for name, value in settings.items():
+        try:
+            setattr(stroke, name, value)
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.debug("skip stroke setting %s: %s", name, e)
@@ -0,0 +1,95 @@
+"""
+bpy.data.imagesのピクセルをndarrayで持っておくキャッシュ
+image.pixelsを毎回読むと重いのでforeach_getで一回読んだものを使い回す
+"""
+from __future__ import annotations
+
+import bpy
+from bpy.app.handlers import persistent
+from collections import OrderedDict
+from logging import getLogger
+from .standalone import lazy_import
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+# 全部合わせてこれを超えたら古いものから捨てる 4Kのfloat RGBAで256MBくらい
+max_bytes = 512 * 1024 * 1024
+
+# 画像名 -> (検証用のキー, ndarray) 後ろほど最近使ったもの
+_cache = OrderedDict()
+# 画像名 -> 更新回数 depsgraphで画像が更新されるたびに増える
+_generations = {}
+
+
+def read_pixels(image: bpy.types.Image) -> np.ndarray:
+    """画像のピクセルを(height, width, 4)のfloat32のndarrayで返す"""
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, 4)
+
+
+def _validation_key(image: bpy.types.Image):
+    return (
+        _generations.get(image.name_full, 0),
+        tuple(image.size),
+        image.is_dirty,
+        image.filepath_raw,
+    )
+
+
+def get_pixels(image: bpy.types.Image) -> np.ndarray:
+    """
+    キャッシュしたピクセルを返す 画像が更新されていたら読み直す
+    返すndarrayは書き換えないこと
+    """
+    name = image.name_full
+    key = _validation_key(image)
+    entry = _cache.get(name)
+    if entry is not None and entry[0] == key:
+        _cache.move_to_end(name)
+        return entry[1]
+    pixels = read_pixels(image)
+    pixels.flags.writeable = False
+    _cache[name] = (key, pixels)
+    _cache.move_to_end(name)
+    _evict()
+    logger.debug("read image pixels: %s %s", name, image.size[:])
+    return pixels
+
+
+def _evict():
+    total = sum(pixels.nbytes for _, pixels in _cache.values())
+    # 最後に読んだ画像だけは上限を超えていても残す
+    while total > max_bytes and len(_cache) > 1:
+        _, (_, pixels) = _cache.popitem(last=False)
+        total -= pixels.nbytes
+
+
+def clear():
+    _cache.clear()
+    _generations.clear()
+
+
+@persistent
+def bump_generation(scene, depsgraph):
+    """更新された画像の更新回数を増やしてキャッシュを無効にする"""
+    if not _cache:
+        return
+    for update in depsgraph.updates:
+        id_data = update.id.original
+        if isinstance(id_data, bpy.types.Image):
+            name = id_data.name_full
+            _generations[name] = _generations.get(name, 0) + 1
+
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(bump_generation)
+
+
+def unregister():
+    if bump_generation in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(bump_generation)
+    clear()
@@ -0,0 +1,55 @@
+"""
+GPオブジェクトのマテリアルの色から作ったColorLUTのキャッシュ
+マテリアルの色かスロットが変わったときだけ作り直す
+"""
+import bpy
+from logging import getLogger
+from . import color_core
+from .standalone import lazy_import
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+# オブジェクト名 -> (マテリアルの色のシグネチャ, ColorLUT, LUTの番号 -> スロット番号)
+_cache = {}
+
+
+def material_colors(obj: bpy.types.Object) -> tuple:
+    """ストロークを描くGPマテリアルの(スロット番号のリスト, リニアのRGBのリスト)"""
+    slots = []
+    colors = []
+    for i, slot in enumerate(obj.material_slots):
+        material = slot.material
+        if material is None or not material.is_grease_pencil:
+            continue
+        # ポイントはストロークの色で描かれるのでストロークを描かないものは使わない
+        if not material.grease_pencil.show_stroke:
+            continue
+        slots.append(i)
+        colors.append(tuple(material.grease_pencil.color[:3]))
+    return slots, colors
+
+
+def get_lut(obj: bpy.types.Object, resolution: int = 32) -> tuple:
+    """
+    (ColorLUT, LUTの番号 -> スロット番号の配列)を返す 使えるマテリアルがなければ(None, None)
+    LUTは見た目に近い距離で引けるようにマテリアルの色をsRGBにして作る
+    """
+    slots, colors = material_colors(obj)
+    signature = (tuple(slots), tuple(colors), resolution)
+    entry = _cache.get(obj.name_full)
+    if entry is not None and entry[0] == signature:
+        return entry[1], entry[2]
+    if not slots:
+        _cache.pop(obj.name_full, None)
+        return None, None
+    lut = color_core.ColorLUT(color_core.linear_to_srgb(colors), resolution)
+    slot_indices = np.array(slots, dtype=np.int64)
+    _cache[obj.name_full] = (signature, lut, slot_indices)
+    logger.debug("build material lut: %s %d materials", obj.name_full, len(slots))
+    return lut, slot_indices
+
+
+def clear():
+    _cache.clear()
@@ -1,11 +1,15 @@
 import bpy
-import bgl
 import math
-import numpy as np
 from logging import getLogger
+from . import color_core
+from .standalone import lazy_import
 
 logger = getLogger(__name__)
 
+# バックグラウンドのバッチ処理では使わないので最初に使うときに読み込む
+np = lazy_import("numpy")
+bgl = lazy_import("bgl")
+
 translation = bpy.app.translations.pgettext
 
 
@@ -19,18 +23,15 @@ def calc_kernel(x, y, size):
     return p1_x, p1_y, w_h
 
 
-def average_color(color: list):
+def average_color(color, method: str = "MEAN"):
     """複数サンプルした時に平均色を求めたい"""
-    c = color
-    avg_color = [c[i : i + 4] for i in range(0, len(c), 4)]
-    avg_color = np.array(avg_color)
-    avg = np.average(avg_color, axis=0)
-    return avg
+    return color_core.reduce_colors(color, method)
 
 
-def capture_under_cursor(buffer, mouse_x=0, mouse_y=0, size=1, type_flg="i") -> list:
+def capture_under_cursor(buffer, mouse_x=0, mouse_y=0, size=1, type_flg="i"):
     """
-    フラットなrgba(float)のlistを返す
+    (size, size, 4)のrgbaのndarrayを返す
+    bufferはget_bufferで取ったもの "i"のときはbufferのビューなので次のキャプチャで上書きされる
     """
     k = calc_kernel(mouse_x, mouse_y, size)
     # GL_FLOATでバッファ作って読むと馬鹿みたいに重いのでGL_BYTE,GL_UNSIGNED_BYTEになってる
@@ -42,12 +43,31 @@ def capture_under_cursor(buffer, mouse_x=0, mouse_y=0, size=1, type_flg="i") ->
         k[2],
         bgl.GL_RGBA,
         bgl.GL_UNSIGNED_BYTE,
-        buffer,
+        buffer.buffer,
     )
     if type_flg == "i":
-        return [value for value in buffer]
+        return buffer.array
     elif type_flg == "f":
-        return [value / 255 for value in buffer]
+        return buffer.array * np.float32(1 / 255)
+
+
+def capture_region(region: bpy.types.Region) -> "np.ndarray":
+    """
+    リージョン全体を(height, width, 4)のfloat(0~1)のndarrayで返す 一回きりのスナップショット用
+    色はディスプレイのsRGBのまま ビューポートのサイズごとに溜まらないようにバッファはプールしない
+    """
+    buffer = PooledBuffer(region.width, region.height)
+    bgl.glReadBuffer(bgl.GL_FRONT)
+    bgl.glReadPixels(
+        region.x,
+        region.y,
+        region.width,
+        region.height,
+        bgl.GL_RGBA,
+        bgl.GL_UNSIGNED_BYTE,
+        buffer.buffer,
+    )
+    return buffer.array * np.float32(1 / 255)
 
 
 def bytes_to_color_code(color: list) -> str:
@@ -61,6 +81,44 @@ def create_buffer(src_width: int = 1, src_height: int = 1):
     return buffer
 
 
+class PooledBuffer:
+    """bgl.Bufferとそれを(height, width, 4)のuint8で見るndarrayの組"""
+
+    def __init__(self, width: int, height: int):
+        self.buffer = create_buffer(width, height)
+        # bglにGL_UNSIGNED_BYTEのバッファはないのでGL_BYTEをuint8として読む
+        try:
+            flat = np.frombuffer(self.buffer, dtype=np.uint8)
+        except (TypeError, ValueError):
+            flat = None
+        self._flat = flat
+        self.shape = (height, width, 4)
+
+    @property
+    def array(self) -> "np.ndarray":
+        if self._flat is not None:
+            return self._flat.reshape(self.shape)
+        # バッファプロトコルに対応していないbglのときはto_listでまとめてコピーする
+        return (np.array(self.buffer.to_list(), dtype=np.int16) & 0xFF).astype(
+            np.uint8
+        ).reshape(self.shape)
+
+
+# (width, height) -> PooledBuffer
+_buffer_pool = {}
+
+
+def get_buffer(width: int, height: int = None) -> PooledBuffer:
+    """サイズごとにバッファを使い回す"""
+    if height is None:
+        height = width
+    key = (width, height)
+    buffer = _buffer_pool.get(key)
+    if buffer is None:
+        buffer = _buffer_pool[key] = PooledBuffer(width, height)
+    return buffer
+
+
 class TEMPLATE_OT_CaptureColor(bpy.types.Operator):
     """カーソル下の色を取得するやつ"""
 
@@ -68,8 +126,12 @@ class TEMPLATE_OT_CaptureColor(bpy.types.Operator):
     bl_label = translation("my operator")
     bl_description = "operator description"
     # bl_options = {"REGISTER", "UNDO"}
-    kernel_size = 3
-    buffer = create_buffer(kernel_size, kernel_size)
+    kernel_size: bpy.props.IntProperty(
+        name="kernel size", default=3, min=1, soft_max=64, max=512
+    )
+    reduction: bpy.props.EnumProperty(
+        name="reduction", items=color_core.REDUCTIONS, default="MEAN"
+    )
     keymaps = []
     # イベントを受け取りたいときはexecuteの代わりにinvokeが使える
 
@@ -78,10 +140,13 @@ class TEMPLATE_OT_CaptureColor(bpy.types.Operator):
         _show_brush = gpencil_paint.show_brush
         gpencil_paint.show_brush = False
         color = capture_under_cursor(
-            self.buffer, event.mouse_x, event.mouse_y, self.kernel_size, "i"
+            get_buffer(self.kernel_size),
+            event.mouse_x,
+            event.mouse_y,
+            self.kernel_size,
+            "f",
         )
-        print(color)
-        color = average_color(color)
+        color = average_color(color, self.reduction)
         gpencil_paint.brush.color = color[:3]
         gpencil_paint.show_brush = _show_brush
 
@@ -90,7 +155,7 @@ class TEMPLATE_OT_CaptureColor(bpy.types.Operator):
         #     b.color = (color[:3])
 
         # logging
-        logger.debug(color)
+        logger.debug("%s", color)
         # infoにメッセージを通知
         self.report({"INFO"}, f"{color}")
         # 正常終了ステータスを返す
@@ -101,7 +166,8 @@ class TEMPLATE_OT_CaptureColor(bpy.types.Operator):
         wm = bpy.context.window_manager
         kc = wm.keyconfigs.addon
         # kc.keys()
-        if kc:
+        # バックグラウンドではキーマップは使わないので登録しない
+        if kc and not bpy.app.background:
             # [3Dビューポート] スペースのショートカットキーとして登録
             km = kc.keymaps.new(name="3D View", space_type="VIEW_3D")
             # ショートカットキーの登録
@@ -125,6 +191,52 @@ class TEMPLATE_OT_CaptureColor(bpy.types.Operator):
         cls.keymaps.clear()
 
 
+def quantize_palette(
+    pixels: "np.ndarray", palette: bpy.types.Palette, size: int = 8
+) -> "np.ndarray":
+    """
+    ピクセルをk-meansでsize色に減色してpaletteの色を置き換える 多い色から並べる
+    パレットの色(size, 3)を返す
+    """
+    colors, counts = color_core.kmeans(pixels, size)
+    order = np.argsort(-counts)
+    colors = colors[order]
+    palette.colors.clear()
+    for color in colors:
+        palette.colors.new().color = color
+    return colors
+
+
+class TEMPLATE_OT_CapturePalette(bpy.types.Operator):
+    """ビューポートの色をパレットに減色してGPのペイントのパレットにする"""
+
+    bl_idname = "template.capture_palette"
+    bl_label = "capture palette"
+    bl_description = "ビューポート全体の色をk-meansで減色してパレットを作る"
+    bl_options = {"REGISTER", "UNDO"}
+
+    palette_size: bpy.props.IntProperty(
+        name="palette size", default=8, min=1, soft_max=32, max=256
+    )
+    palette_name: bpy.props.StringProperty(name="palette", default="ScatterCapture")
+
+    @classmethod
+    def poll(cls, context):
+        return context.area is not None and context.area.type == "VIEW_3D"
+
+    def execute(self, context):
+        region = next(r for r in context.area.regions if r.type == "WINDOW")
+        pixels = capture_region(region)
+        palette = bpy.data.palettes.get(self.palette_name)
+        if palette is None:
+            palette = bpy.data.palettes.new(self.palette_name)
+        colors = quantize_palette(pixels, palette, self.palette_size)
+        context.tool_settings.gpencil_paint.palette = palette
+        logger.debug("%s", colors)
+        self.report({"INFO"}, f"{len(colors)} colors: {palette.name}")
+        return {"FINISHED"}
+
+
 class TEMPLATE_PT_CursorColor(bpy.types.Panel):
     bl_label = "CursorColor"
     bl_space_type = "VIEW_3D"
@@ -133,15 +245,22 @@ class TEMPLATE_PT_CursorColor(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         layout.operator(TEMPLATE_OT_CaptureColor.bl_idname)
+        layout.operator(TEMPLATE_OT_CapturePalette.bl_idname)
 
 
-classses = [TEMPLATE_OT_CaptureColor, TEMPLATE_PT_CursorColor]
+classses = [TEMPLATE_OT_CaptureColor, TEMPLATE_OT_CapturePalette]
+# UIがあるときだけ登録するもの
+panels = [TEMPLATE_PT_CursorColor]
 tools = []
 
 
 def register():
     for c in classses:
         bpy.utils.register_class(c)
+    if bpy.app.background:
+        return
+    for c in panels:
+        bpy.utils.register_class(c)
     for t in tools:
         bpy.utils.register_tool(t)
 
@@ -149,5 +268,9 @@ def register():
 def unregister():
     for c in classses:
         bpy.utils.unregister_class(c)
+    if bpy.app.background:
+        return
+    for c in panels:
+        bpy.utils.unregister_class(c)
     for t in tools:
         bpy.utils.unregister_tool(t)
@@ -0,0 +1,180 @@
+"""
+散布したストロークのほとんど重なっているポイントを間引く
+ストロークごとにポイントをtolerance四方のグリッドに分けてセルごとに1点だけ残し、ストロークを書き直す
+"""
+import bpy
+from logging import getLogger
+from . import gp_snapshot
+from . import scatter_core
+from .standalone import lazy_import
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+translation = bpy.app.translations.pgettext
+
+DECIMATE_MODES = (
+    ("DROP", "drop", "セルの最初のポイントだけ残す"),
+    ("MERGE", "merge", "セルのポイントを平均した1点にまとめる"),
+)
+
+
+def decimate_data(data: dict, tolerance: float, merge: bool = False, mask=None) -> dict:
+    """
+    gp_snapshotのdataのポイントをストロークごとにグリッドで間引いたものを返す
+    別のストロークのポイントとは同じセルにしないので重なった線で穴が開かない
+    セルの代表はそのセルで最初のポイントでmergeなら値を平均に置き換える
+    maskを渡すとTrueのストロークだけ間引く ストロークの数と並びは変えない
+    """
+    offsets = data["stroke_offsets"]
+    owner = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    if mask is None:
+        targets = np.arange(len(owner))
+    else:
+        targets = np.flatnonzero(np.asarray(mask, dtype=bool)[owner])
+    first, inverse = scatter_core.grid_cells(
+        data["co"][targets], tolerance, owner[targets]
+    )
+    keep = np.ones(len(owner), dtype=bool)
+    keep[targets] = False
+    keep[targets[first]] = True
+    if merge:
+        data = dict(data)
+        for name, _, _ in gp_snapshot.point_attributes(data):
+            values = np.array(data[name])
+            values[targets[first]] = scatter_core.cell_means(
+                values[targets], inverse, len(first)
+            )
+            data[name] = values
+    return gp_snapshot.filter_points(data, keep, drop_empty=False)
+
+
+def local_tolerance(obj: bpy.types.Object, tolerance: float) -> float:
+    """
+    ワールド単位のtoleranceをobjのローカルに直す
+    スケールが0以下で直せないときは0を返すので呼び出し側は間引かない
+    """
+    scale = max(obj.matrix_world.to_scale())
+    return tolerance / scale if scale > 0 else 0.0
+
+
+def has_weights(stroke: bpy.types.GPencilStroke) -> bool:
+    """ストロークが頂点グループのウェイトを持っているか"""
+    if len(stroke.points) == 0:
+        return False
+    try:
+        stroke.points.weight_get(vertex_group_index=0, point_index=0)
+    except (RuntimeError, ValueError):
+        # ウェイトを持っていないストロークはエラーになる
+        return False
+    return True
+
+
+def lost_data(obj: bpy.types.Object, strokes: bpy.types.GPencilStrokes, mask) -> str:
+    """
+    decimate_strokesで作り直すストロークにスナップショットに入らないデータがあればその名前を返す
+    頂点グループのウェイトと編集カーブは作り直すと消える なければ空文字
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any():
+        return ""
+    tail = list(strokes)[int(np.argmax(mask)) :]
+    if any(getattr(stroke, "edit_curve", None) is not None for stroke in tail):
+        return "edit curve"
+    if len(obj.vertex_groups) and any(has_weights(stroke) for stroke in tail):
+        return "vertex group weights"
+    return ""
+
+
+def decimate_strokes(
+    strokes: bpy.types.GPencilStrokes, mask, tolerance: float, merge: bool = False
+) -> tuple:
+    """
+    maskがTrueのストロークを間引いたものに置き換える
+    ストロークは並べ替えられないので最初に間引くストローク以降を設定ごと作り直して並びを保つ
+    作り直したストロークの頂点グループのウェイトと編集カーブは残らないので先にlost_dataで確かめる
+    (前のポイント数, 後のポイント数)を返す
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any():
+        return 0, 0
+    first = int(np.argmax(mask))
+    tail = gp_snapshot.read_strokes(strokes, extra=True, first=first)
+    result = decimate_data(tail, tolerance, merge, mask[first:])
+    old_strokes = list(strokes)[first:]
+    settings = [gp_snapshot.stroke_settings(stroke) for stroke in old_strokes]
+    for stroke in reversed(old_strokes):
+        strokes.remove(stroke)
+    gp_snapshot.write_strokes(strokes, result, settings=settings)
+    counts = np.diff(tail["stroke_offsets"])[mask[first:]]
+    after = np.diff(result["stroke_offsets"])[mask[first:]]
+    return int(counts.sum()), int(after.sum())
+
+
+class ScatterGpencilDecimateOps(bpy.types.Operator):
+    """選択中のストロークのポイントを間引くオペレータ"""
+
+    bl_idname = "gpencil.scatter_decimate"
+    bl_label = "decimate scatter"
+    bl_description = "選択中のストロークでtoleranceより近いポイントを間引く"
+    bl_options = {"REGISTER", "UNDO"}
+
+    tolerance: bpy.props.FloatProperty(
+        name="tolerance",
+        default=0.005,
+        min=0.00001,
+        soft_max=0.1,
+        description="この大きさのセルに入るポイントを1点にする(ワールド単位)",
+    )
+    mode: bpy.props.EnumProperty(name="mode", items=DECIMATE_MODES, default="DROP")
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type == "GPENCIL"
+
+    def execute(self, context):
+        obj: bpy.types.Object = context.active_object
+        # ワールド単位で指定したいのでローカルのtoleranceはスケールで割る
+        tolerance = local_tolerance(obj, self.tolerance)
+        if tolerance <= 0:
+            self.report({"WARNING"}, "object scale is zero")
+            return {"CANCELLED"}
+        before = after = 0
+        for layer in obj.data.layers:
+            frame = layer.active_frame
+            if layer.hide or layer.lock or frame is None:
+                continue
+            strokes = frame.strokes
+            select = np.empty(len(strokes), dtype=bool)
+            strokes.foreach_get("select", select)
+            lost = lost_data(obj, strokes, select)
+            if lost:
+                self.report(
+                    {"WARNING"}, f"skip layer {layer.info}: {lost} would be lost"
+                )
+                continue
+            b, a = decimate_strokes(strokes, select, tolerance, self.mode == "MERGE")
+            before += b
+            after += a
+        self.report({"INFO"}, f"{before} -> {after} points")
+        return {"FINISHED"}
+
+
+classses = [ScatterGpencilDecimateOps]
+tools = []
+
+
+def register():
+    for c in classses:
+        bpy.utils.register_class(c)
+    for t in tools:
+        bpy.utils.register_tool(t)
+
+
+def unregister():
+    for c in classses:
+        bpy.utils.unregister_class(c)
+    for t in tools:
+        bpy.utils.unregister_tool(t)
@@ -0,0 +1,287 @@
+"""
+モーダルを使わずにガイドに沿ってまとめて散布する
+blender -bのバッチ処理からも使えるようにオペレータとは別に関数でも呼べる
+"""
+import bpy
+import mathutils
+from logging import getLogger
+from mathutils.geometry import interpolate_bezier
+from . import gp_snapshot, scatter_core
+from .standalone import lazy_import
+from .util import get_or_create_frame
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+translation = bpy.app.translations.pgettext
+
+
+def curve_guides(obj: bpy.types.Object, resolution: int = None) -> list:
+    """
+    カーブオブジェクトのスプラインごとにワールド座標の折れ線を返す
+    resolutionを省略するとベジェの1区間をスプラインのresolution_uで分割する
+    """
+    matrix = np.array(obj.matrix_world)
+    guides = []
+    for spline in obj.data.splines:
+        if spline.type == "BEZIER":
+            knots = spline.bezier_points
+            segments = list(zip(knots, knots[1:]))
+            if spline.use_cyclic_u and len(knots) > 1:
+                segments.append((knots[-1], knots[0]))
+            points = []
+            steps = resolution or spline.resolution_u
+            for k1, k2 in segments:
+                segment = interpolate_bezier(
+                    k1.co, k1.handle_right, k2.handle_left, k2.co, steps + 1
+                )
+                # 区間のつなぎ目が重複しないように始点は前の区間の終点を使う
+                points.extend(segment if not points else segment[1:])
+            if not points:
+                points = [k.co for k in knots]
+            guide = np.array([p[:] for p in points])
+        else:
+            # POLY/NURBSは制御点の折れ線で近似する
+            guide = np.empty(len(spline.points) * 4)
+            spline.points.foreach_get("co", guide)
+            guide = guide.reshape(-1, 4)[:, :3]
+        if len(guide):
+            guides.append(scatter_core.transform_points(matrix, guide))
+    return guides
+
+
+def frame_guides(
+    frame: bpy.types.GPencilFrame, matrix: "np.ndarray", selected_only: bool = False
+) -> list:
+    """フレームのストロークをmatrixで変換した折れ線として返す"""
+    guides = []
+    for stroke in frame.strokes:
+        if selected_only and not stroke.select:
+            continue
+        guide = np.empty(len(stroke.points) * 3)
+        stroke.points.foreach_get("co", guide)
+        if len(guide):
+            guides.append(scatter_core.transform_points(matrix, guide.reshape(-1, 3)))
+    return guides
+
+
+def gpencil_guides(obj: bpy.types.Object, selected_only: bool = False) -> list:
+    """GPオブジェクトの各レイヤーのアクティブフレームのストロークを折れ線として返す"""
+    matrix = np.array(obj.matrix_world)
+    guides = []
+    for layer in obj.data.layers:
+        frame = layer.active_frame
+        if layer.hide or frame is None:
+            continue
+        guides.extend(frame_guides(frame, matrix, selected_only))
+    return guides
+
+
+def object_guides(obj: bpy.types.Object) -> list:
+    if obj.type == "CURVE":
+        return curve_guides(obj)
+    if obj.type == "GPENCIL":
+        return gpencil_guides(obj)
+    raise TypeError(f"unsupported guide object type: {obj.type}")
+
+
+def scatter_bulk(
+    obj: bpy.types.Object,
+    guides: list,
+    spacing: float = 0.05,
+    count: int = 10,
+    scatter_rate: float = 0.5,
+    distribution: str = "GAUSS",
+    size: int = 20,
+    layer: bpy.types.GPencilLayer = None,
+    frame_number: int = None,
+    material_index: int = None,
+    max_points_per_stroke: int = 0,
+    seed: int = None,
+) -> int:
+    """
+    ワールド座標のガイドの折れ線のリストに沿ってobjに散布する
+    layerとframe_numberを省略するとアクティブレイヤーの現在のフレームに書く
+    書き込んだポイント数を返す
+    """
+    if layer is None:
+        layer = obj.data.layers.active
+        if layer is None:
+            raise ValueError("no active layer")
+    if frame_number is None:
+        frame_number = bpy.context.scene.frame_current
+    if material_index is None:
+        material_index = obj.active_material_index
+    frame = get_or_create_frame(layer, frame_number)
+    rng = scatter_core.get_rng(seed)
+    results = scatter_core.scatter_along_guides(
+        guides, spacing, count, scatter_rate, distribution, rng
+    )
+    return write_results(
+        obj, frame, results, material_index, size, max_points_per_stroke
+    )
+
+
+def write_results(
+    obj: bpy.types.Object,
+    frame: bpy.types.GPencilFrame,
+    results: list,
+    material_index: int = 0,
+    size: int = 20,
+    max_points_per_stroke: int = 0,
+) -> int:
+    """
+    scatter_along_guidesの結果(ワールド座標)をobjのローカルにしてframeに書き込む
+    書き込んだポイント数を返す
+    """
+    i_matrix = np.array(mathutils.Matrix(obj.matrix_world).inverted_safe())
+    data = results_snapshot(
+        results, i_matrix, material_index, size, max_points_per_stroke
+    )
+    gp_snapshot.write_strokes(frame.strokes, data)
+    return int(data["stroke_offsets"][-1])
+
+
+def results_snapshot(
+    results: list,
+    matrix: "np.ndarray",
+    material_index: int = 0,
+    size: int = 20,
+    max_points_per_stroke: int = 0,
+) -> dict:
+    """
+    scatter_along_guidesの結果をmatrixで変換してgp_snapshotのストロークの形式にする
+    max_points_per_strokeを超える分は別のストロークに分ける
+    """
+    results = [(co, pressure) for co, pressure in results if len(co)]
+    counts = []
+    for co, _ in results:
+        chunk = max_points_per_stroke or len(co)
+        full, rest = divmod(len(co), chunk)
+        counts.extend([chunk] * full + ([rest] if rest else []))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    total = int(offsets[-1])
+    data = {
+        "stroke_offsets": offsets,
+        "material_index": np.full(len(counts), material_index, dtype=np.int32),
+        "line_width": np.full(len(counts), size, dtype=np.int32),
+        "co": np.empty((total, 3), dtype=np.float32),
+        "pressure": np.empty(total, dtype=np.float32),
+        "strength": np.ones(total, dtype=np.float32),
+        "vertex_color": np.zeros((total, 4), dtype=np.float32),
+    }
+    start = 0
+    for co, pressure in results:
+        end = start + len(co)
+        data["co"][start:end] = scatter_core.transform_points(matrix, co)
+        data["pressure"][start:end] = pressure
+        start = end
+    return data
+
+
+class ScatterGpencilBulkOps(bpy.types.Operator):
+    """ガイドに沿ってまとめて散布するオペレータ"""
+
+    bl_idname = "gpencil.scatter_bulk"
+    bl_label = "scatter gpencil bulk"
+    bl_description = "カーブかGPのストロークに沿ってまとめて散布する"
+    bl_options = {"REGISTER", "UNDO"}
+
+    guide_object: bpy.props.StringProperty(
+        name="guide object",
+        default="",
+        description="ガイドにするカーブかGPオブジェクトの名前 空ならアクティブの選択ストローク",
+    )
+    spacing: bpy.props.FloatProperty(
+        name="spacing",
+        default=0.05,
+        min=0.0001,
+        soft_max=1,
+        description="ガイド上で散布する間隔(ワールド単位)",
+    )
+    count: bpy.props.IntProperty(
+        name="count", default=10, min=1, soft_max=500, description="間隔ごとのポイント数"
+    )
+    scatter_rate: bpy.props.FloatProperty(
+        name="scatter rate",
+        default=0.5,
+        soft_max=100,
+        soft_min=0,
+        description="散乱具合",
+    )
+    distribution: bpy.props.EnumProperty(
+        name="distribution",
+        items=scatter_core.DISTRIBUTIONS,
+        default="GAUSS",
+        description="散布の分布",
+    )
+    size: bpy.props.IntProperty(
+        name="brush size", default=20, min=1, max=1000, description="ブラシサイズ"
+    )
+    max_points_per_stroke: bpy.props.IntProperty(
+        name="max points per stroke",
+        default=0,
+        min=0,
+        description="1ストロークのポイント数の上限 0で無制限",
+    )
+    seed: bpy.props.IntProperty(name="seed", default=0, min=0)
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return (
+            obj is not None
+            and obj.type == "GPENCIL"
+            and obj.data.layers.active is not None
+        )
+
+    def execute(self, context):
+        obj: bpy.types.Object = context.active_object
+        if self.guide_object:
+            guide_obj = bpy.data.objects.get(self.guide_object)
+            if guide_obj is None:
+                self.report({"ERROR"}, f"object not found: {self.guide_object}")
+                return {"CANCELLED"}
+            try:
+                guides = object_guides(guide_obj)
+            except TypeError as e:
+                self.report({"ERROR"}, str(e))
+                return {"CANCELLED"}
+        else:
+            guides = gpencil_guides(obj, selected_only=True)
+        if not guides:
+            self.report({"WARNING"}, "no guides")
+            return {"CANCELLED"}
+        total = scatter_bulk(
+            obj,
+            guides,
+            spacing=self.spacing,
+            count=self.count,
+            scatter_rate=self.scatter_rate,
+            distribution=self.distribution,
+            size=self.size,
+            max_points_per_stroke=self.max_points_per_stroke,
+            seed=self.seed,
+        )
+        self.report({"INFO"}, f"{total} points")
+        return {"FINISHED"}
+
+
+classses = [ScatterGpencilBulkOps]
+tools = []
+
+
+def register():
+    for c in classses:
+        bpy.utils.register_class(c)
+    for t in tools:
+        bpy.utils.register_tool(t)
+
+
+def unregister():
+    for c in classses:
+        bpy.utils.unregister_class(c)
+    for t in tools:
+        bpy.utils.unregister_tool(t)
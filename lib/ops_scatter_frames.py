@@ -0,0 +1,244 @@
+"""
+フレーム範囲のキーフレームごとに違う乱数で散布する(ボイリング用)
+点の生成はbpyに依存しないのでプロセスプールで並列に作り、書き込みだけメインスレッドでやる
+"""
+import bpy
+import multiprocessing
+import os
+import site
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from logging import getLogger
+from . import ops_scatter_bulk
+from . import scatter_core
+from . import standalone
+from .standalone import lazy_import
+from .util import get_or_create_frame
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+translation = bpy.app.translations.pgettext
+
+
+def layer_frame_guides(
+    obj: bpy.types.Object, layer: bpy.types.GPencilLayer, frame_start, frame_end
+) -> dict:
+    """レイヤーのキーフレームごとのガイド {frame_number: [折れ線...]}"""
+    matrix = np.array(obj.matrix_world)
+    return {
+        frame.frame_number: ops_scatter_bulk.frame_guides(frame, matrix)
+        for frame in layer.frames
+        if frame_start <= frame.frame_number <= frame_end
+    }
+
+
+@contextmanager
+def hide_main_file():
+    """
+    spawnのワーカーは__main__の__file__のスクリプトを読み直すので、その間だけ隠す
+    blender -b --python job.pyだとjob.py(bpyをimportする)を読み直してワーカーが落ちる
+    """
+    main = sys.modules.get("__main__")
+    saved = {}
+    for name in ("__file__", "__spec__"):
+        if main is not None and getattr(main, name, None) is not None:
+            saved[name] = getattr(main, name)
+            if name == "__file__":
+                delattr(main, name)
+            else:
+                setattr(main, name, None)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+
+
+def generate_frames(jobs: list, workers: int = 0):
+    """
+    jobs(scatter_frame_jobの引数のタプルのリスト)を並列に実行して
+    できたものから(frame_number, 結果)をyieldする
+    プロセスプールが使えない環境では順番に実行する
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    done = set()
+    if workers > 1:
+        try:
+            # ワーカーはアドオンのパッケージ(bpyをimportする)を経由せずにscatter_coreを読む
+            core = standalone.load("scatter_core")
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(
+                workers,
+                mp_context=context,
+                initializer=site.addsitedir,
+                initargs=(standalone.lib_dir,),
+            ) as executor:
+                # ワーカーはsubmitのときに起動されるので投げ終わるまで隠しておく
+                with hide_main_file():
+                    futures = [
+                        executor.submit(core.scatter_frame_job, *job) for job in jobs
+                    ]
+                for future in as_completed(futures):
+                    frame_number, results = future.result()
+                    done.add(frame_number)
+                    yield frame_number, results
+            return
+        except Exception as e:
+            # ワーカーが起動できなかったときなど 残りのフレームを順番にやる
+            logger.warning("process pool failed, fallback to serial: %s", e)
+    for job in jobs:
+        if job[0] not in done:
+            yield scatter_core.scatter_frame_job(*job)
+
+
+class ScatterGpencilFramesOps(bpy.types.Operator):
+    """フレーム範囲のキーフレームごとに散布するオペレータ"""
+
+    bl_idname = "gpencil.scatter_frames"
+    bl_label = "scatter gpencil frames"
+    bl_description = "フレームごとに違う乱数でガイドに沿って散布する"
+    bl_options = {"REGISTER", "UNDO"}
+
+    guide_source: bpy.props.EnumProperty(
+        name="guide source",
+        items=(
+            ("LAYER", "layer", "guide_layerの各キーフレームのストローク"),
+            ("OBJECT", "object", "guide_objectを全フレーム共通のガイドにする"),
+        ),
+        default="LAYER",
+    )
+    guide_layer: bpy.props.StringProperty(
+        name="guide layer", default="", description="ガイドにするレイヤーの名前"
+    )
+    guide_object: bpy.props.StringProperty(
+        name="guide object", default="", description="ガイドにするカーブかGPオブジェクトの名前"
+    )
+    frame_start: bpy.props.IntProperty(name="start", default=1)
+    frame_end: bpy.props.IntProperty(name="end", default=24)
+    frame_step: bpy.props.IntProperty(
+        name="step", default=1, min=1, description="objectのときに何フレームおきに散布するか"
+    )
+    spacing: bpy.props.FloatProperty(
+        name="spacing",
+        default=0.05,
+        min=0.0001,
+        soft_max=1,
+        description="ガイド上で散布する間隔(ワールド単位)",
+    )
+    count: bpy.props.IntProperty(
+        name="count", default=10, min=1, soft_max=500, description="間隔ごとのポイント数"
+    )
+    scatter_rate: bpy.props.FloatProperty(
+        name="scatter rate",
+        default=0.5,
+        soft_max=100,
+        soft_min=0,
+        description="散乱具合",
+    )
+    distribution: bpy.props.EnumProperty(
+        name="distribution",
+        items=scatter_core.DISTRIBUTIONS,
+        default="GAUSS",
+        description="散布の分布",
+    )
+    size: bpy.props.IntProperty(
+        name="brush size", default=20, min=1, max=1000, description="ブラシサイズ"
+    )
+    max_points_per_stroke: bpy.props.IntProperty(
+        name="max points per stroke",
+        default=0,
+        min=0,
+        description="1ストロークのポイント数の上限 0で無制限",
+    )
+    seed: bpy.props.IntProperty(
+        name="seed", default=0, min=0, description="フレーム番号を足したものを各フレームのseedにする"
+    )
+    workers: bpy.props.IntProperty(
+        name="workers", default=0, min=0, description="ワーカープロセス数 0でCPU数"
+    )
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        # 書き込み先のレイヤーはワーカーの処理が終わってから引くので先に確かめておく
+        return (
+            obj is not None
+            and obj.type == "GPENCIL"
+            and obj.data.layers.active is not None
+        )
+
+    def collect_guides(self, context) -> dict:
+        obj: bpy.types.Object = context.active_object
+        if self.guide_source == "LAYER":
+            layer = obj.data.layers.get(self.guide_layer)
+            if layer is None:
+                raise KeyError(f"layer not found: {self.guide_layer}")
+            return layer_frame_guides(obj, layer, self.frame_start, self.frame_end)
+        guide_obj = bpy.data.objects.get(self.guide_object)
+        if guide_obj is None:
+            raise KeyError(f"object not found: {self.guide_object}")
+        guides = ops_scatter_bulk.object_guides(guide_obj)
+        frames = range(self.frame_start, self.frame_end + 1, self.frame_step)
+        return {frame_number: guides for frame_number in frames}
+
+    def execute(self, context):
+        obj: bpy.types.Object = context.active_object
+        try:
+            guides = self.collect_guides(context)
+        except (KeyError, TypeError) as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
+        jobs = [
+            (
+                frame_number,
+                frame_guides,
+                self.spacing,
+                self.count,
+                self.scatter_rate,
+                self.distribution,
+                self.seed + frame_number,
+            )
+            for frame_number, frame_guides in guides.items()
+            if frame_guides
+        ]
+        if not jobs:
+            self.report({"WARNING"}, "no guides")
+            return {"CANCELLED"}
+        layer = obj.data.layers.active
+        material_index = obj.active_material_index
+        total = 0
+        for frame_number, results in generate_frames(jobs, self.workers):
+            frame = get_or_create_frame(layer, frame_number)
+            total += ops_scatter_bulk.write_results(
+                obj,
+                frame,
+                results,
+                material_index,
+                self.size,
+                self.max_points_per_stroke,
+            )
+        self.report({"INFO"}, f"{len(jobs)} frames, {total} points")
+        return {"FINISHED"}
+
+
+classses = [ScatterGpencilFramesOps]
+tools = []
+
+
+def register():
+    for c in classses:
+        bpy.utils.register_class(c)
+    for t in tools:
+        bpy.utils.register_tool(t)
+
+
+def unregister():
+    for c in classses:
+        bpy.utils.unregister_class(c)
+    for t in tools:
+        bpy.utils.unregister_tool(t)
@@ -1,78 +1,151 @@
 import bpy
 from logging import getLogger
+from time import perf_counter
 import mathutils
-from bpy_extras import view3d_utils
-from random import gauss, uniform
+from bpy_extras.io_utils import ExportHelper
+from . import scatter_core
+from . import surface_cache
+from . import gp_snapshot
+from . import ops_decimate_gpencil
+from . import color_core
+from . import ops_capture_color
+from . import image_cache
+from . import material_cache
+from .standalone import lazy_import
 
 logger = getLogger(__name__)
 
+# バックグラウンドのバッチ処理では使わないので最初に使うときに読み込む
+np = lazy_import("numpy")
+tick_metrics = lazy_import(f"{__package__}.tick_metrics")
+rng_pool = lazy_import(f"{__package__}.rng_pool")
+tick_scheduler = lazy_import(f"{__package__}.tick_scheduler")
+gpu = lazy_import("gpu")
+gpu_batch = lazy_import("gpu_extras.batch")
+
 translation = bpy.app.translations.pgettext
 
+# 最後(実行中含む)のセッションの計測値 パネルとダンプで使う
+last_metrics: "tick_metrics.TickMetrics" = None
+
+# 散布で使う乱数のプール ワーカースレッドは最初の散布で起動してunregisterで止める
+_random_pool: "rng_pool.RandomPool" = None
+
+
+def get_random_pool() -> "rng_pool.RandomPool":
+    global _random_pool
+    if _random_pool is None:
+        _random_pool = rng_pool.RandomPool()
+    return _random_pool
+
+
+def find_view3d_under_cursor(context: bpy.types.Context, event: bpy.types.Event):
+    """
+    カーソル下の3Dビューポートの(area, WINDOWリージョン)を返す
+    四分割表示でもカーソルのあるリージョンを拾う
+    """
+    x, y = event.mouse_x, event.mouse_y
+    for area in context.window.screen.areas:
+        if area.type != "VIEW_3D":
+            continue
+        if not (area.x <= x < area.x + area.width and area.y <= y < area.y + area.height):
+            continue
+        for region in area.regions:
+            if region.type != "WINDOW":
+                continue
+            if (
+                region.x <= x < region.x + region.width
+                and region.y <= y < region.y + region.height
+            ):
+                return area, region
+    return context.area, context.region
+
+
+class ViewCache:
+    """
+    モーダル中に使うリージョンと投影行列のキャッシュ
+    ビューの行列かリージョンのサイズが変わったときだけ作り直す
+    """
+
+    def __init__(self, area: bpy.types.Area, region: bpy.types.Region):
+        self.area = area
+        self.region = region
+        self.region_3d: bpy.types.RegionView3D = region.data
+        self.depth_location = np.array([1.0, 1.0, 1.0])
+        self.update()
+
+    def update(self):
+        rv3d = self.region_3d
+        self._perspective_matrix = rv3d.perspective_matrix.copy()
+        self.perspective_matrix = np.array(self._perspective_matrix)
+        self.perspective_matrix_inv = np.array(self._perspective_matrix.inverted())
+        self.view_normal = np.array(rv3d.view_matrix.inverted().col[2][:3])
+        self.size = (self.region.width, self.region.height)
+
+    def validate(self) -> bool:
+        """ナビゲーションやリサイズで変わっていたら作り直してTrueを返す"""
+        region = self.region
+        if (
+            (region.width, region.height) == self.size
+            and self.region_3d.perspective_matrix == self._perspective_matrix
+        ):
+            return False
+        self.update()
+        return True
+
+    def region_coord(self, event: bpy.types.Event) -> "np.ndarray":
+        """イベントのウィンドウ座標をキャッシュしたリージョンの座標にする"""
+        return np.array(
+            [event.mouse_x - self.region.x, event.mouse_y - self.region.y],
+            dtype=np.float64,
+        )
+
+    def locations3d(self, coords: "np.ndarray", depth_location=None) -> "np.ndarray":
+        """リージョン座標(N, 2)をまとめてワールド座標(N, 3)にする"""
+        if depth_location is None:
+            depth_location = self.depth_location
+        ndc = scatter_core.region_to_ndc(coords, *self.size)
+        return scatter_core.unproject_to_plane(
+            ndc, self.perspective_matrix_inv, depth_location, self.view_normal
+        )
+
+    def location3d(self, event: bpy.types.Event, depth_location=None) -> "np.ndarray":
+        return self.locations3d(self.region_coord(event), depth_location)[0]
+
+
+class StrokeWriter:
+    """
+    ストロークのポイントをforeach_setでまとめて書き込むやつ
+    foreach_setはコレクション全体にしか使えないので書き込んだ値をStagingBufferで保持しておく
+    追加は定数時間になるが書き込みはストロークの長さに比例するのでmax_points_per_strokeで切る
+    """
 
-def get_region_and_space(context, area_type, region_type, space_type):
-    """https://colorful-pico.net/introduction-to-addon-development-in-blender/2.8/html/chapter_03/08_Use_Coordinate_Transformation.html"""
-    region = None
-    area = None
-    space = None
-
-    # 指定されたエリアの情報を取得する
-    for a in context.screen.areas:
-        if a.type == area_type:
-            area = a
-            break
-    else:
-        return (None, None)
-    # 指定されたリージョンの情報を取得する
-    for r in area.regions:
-        if r.type == region_type:
-            region = r
-            break
-    # 指定されたスペースの情報を取得する
-    for s in area.spaces:
-        if s.type == space_type:
-            space = s
-            break
-
-    return (region, space)
-
-
-def get_location3d(
-    context: bpy.types.Context,
-    event: bpy.types.Event,
-    depth_location: mathutils.Vector = mathutils.Vector([1, 1, 1]),
-):
-    # マウスカーソルのリージョン座標を取得
-    mv = mathutils.Vector((event.mouse_region_x, event.mouse_region_y))
-    # [3Dビューポート] スペースを表示するエリアの [Window] リージョンの
-    # 情報と、[3Dビューポート] スペースのスペース情報を取得する
-    region, space = get_region_and_space(context, "VIEW_3D", "WINDOW", "VIEW_3D")
-    # グローバル座標
-    location = view3d_utils.region_2d_to_location_3d(
-        region, space.region_3d, mv, depth_location
-    )
-
-    return location
-
-
-def get_local_coord_from_global_coord(obj: bpy.types.Object, location):
-    """グローバル座標からローカル座標を求めたい"""
-    matrix = obj.matrix_world
-    matrix = mathutils.Matrix(matrix).inverted_safe()
-    # 行列何もわからん
-    local_location = matrix @ location
-    return local_location
-
-
-def random_gauss_vector(factor: float = 1.0):
-    v1 = mathutils.Vector([gauss(0, 0.1) for _ in range(3)])
-    v1 *= factor
-    return v1
-
-
-def random_square_vector(factor: float = 1.0):
-    v1 = mathutils.Vector([uniform(-1, 1) for _ in range(3)])
-    v1 *= factor
-    return v1
+    def __init__(self, stroke: bpy.types.GPencilStroke):
+        self.stroke = stroke
+        self.buffer = scatter_core.StagingBuffer()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def append(
+        self,
+        co: "np.ndarray",
+        pressure: "np.ndarray",
+        strength: "np.ndarray",
+        vertex_color: "np.ndarray" = None,
+    ):
+        count = len(co)
+        if count == 0:
+            return
+        buffer = self.buffer
+        buffer.append(co, pressure, strength, vertex_color)
+        points = self.stroke.points
+        points.add(count)
+        points.foreach_set("co", buffer.co.ravel())
+        points.foreach_set("pressure", buffer.pressure)
+        points.foreach_set("strength", buffer.strength)
+        if buffer.use_color:
+            points.foreach_set("vertex_color", buffer.vertex_color.ravel())
 
 
 class ScatterGpencilOps(bpy.types.Operator):
@@ -100,53 +173,771 @@ class ScatterGpencilOps(bpy.types.Operator):
         soft_min=0,
         description="散乱具合",
     )
+    distribution: bpy.props.EnumProperty(
+        name="distribution",
+        items=scatter_core.DISTRIBUTIONS,
+        default="GAUSS",
+        description="散布の分布",
+    )
+    scatter_space: bpy.props.EnumProperty(
+        name="scatter space",
+        items=(
+            ("WORLD", "world", "scatter_rateでワールド空間に散布する"),
+            ("SCREEN", "screen", "画面上のscreen_radius(px)の円内に散布する ズームに依存しない"),
+        ),
+        default="WORLD",
+        description="散布する空間",
+    )
+    screen_radius: bpy.props.IntProperty(
+        name="screen radius",
+        default=50,
+        min=0,
+        soft_max=500,
+        max=5000,
+        subtype="PIXEL",
+        description="screenモードでの散布半径(px)",
+    )
     size: bpy.props.IntProperty(
         name="brush size", default=20, min=1, max=1000, description="ブラシサイズ"
     )
+    count: bpy.props.IntProperty(
+        name="count",
+        default=10,
+        min=1,
+        soft_max=500,
+        max=10000,
+        description="1ドローあたりのポイント数",
+    )
+    use_scheduler: bpy.props.BoolProperty(
+        name="adaptive",
+        default=False,
+        description="1ティックの時間を見てポイント数とタイマー間隔を自動で決める timerモードのみ",
+    )
+    tick_budget: bpy.props.FloatProperty(
+        name="tick budget",
+        default=8.0,
+        min=0.5,
+        soft_max=50,
+        description="adaptiveで1ティックにかけてよい時間(ms)",
+    )
+    points_per_second: bpy.props.FloatProperty(
+        name="points/sec",
+        default=100.0,
+        min=1,
+        soft_max=100000,
+        description="adaptiveで出したい1秒あたりのポイント数",
+    )
+    sample_mode: bpy.props.EnumProperty(
+        name="sample mode",
+        items=(
+            ("TIMER", "timer", "タイマーごとにカーソル位置へcount個散布する"),
+            ("PATH", "path", "マウスの軌跡に沿ってspacing間隔で散布する"),
+        ),
+        default="TIMER",
+        description="散布する位置の決め方",
+    )
+    spacing: bpy.props.FloatProperty(
+        name="spacing",
+        default=0.05,
+        min=0.0001,
+        soft_max=1,
+        description="pathモードでのポイント間隔(ワールド単位)",
+    )
+    use_stamp: bpy.props.BoolProperty(
+        name="stamp",
+        default=False,
+        description="1点ずつではなく用意しておいたスタンプ(点のかたまり)を回転/拡大して置く",
+    )
+    stamp_source: bpy.props.EnumProperty(
+        name="stamp source",
+        items=(
+            ("PROCEDURAL", "procedural", "distributionで作ったかたまりを使う"),
+            ("STROKES", "strokes", "開始時に選択中のストロークを1本ずつスタンプにする"),
+        ),
+        default="PROCEDURAL",
+    )
+    stamp_points: bpy.props.IntProperty(
+        name="stamp points",
+        default=32,
+        min=1,
+        soft_max=1000,
+        description="proceduralのスタンプ1つあたりのポイント数",
+    )
+    stamp_variants: bpy.props.IntProperty(
+        name="stamp variants",
+        default=8,
+        min=1,
+        soft_max=64,
+        description="proceduralで用意するスタンプの種類",
+    )
+    stamp_count: bpy.props.IntProperty(
+        name="stamps",
+        default=1,
+        min=1,
+        soft_max=100,
+        description="timerモードで1ドローあたりに置くスタンプ数",
+    )
+    stamp_size: bpy.props.FloatProperty(
+        name="stamp size",
+        default=0.2,
+        min=0,
+        soft_max=10,
+        description="proceduralのスタンプの半径(ワールド単位) strokesは元の大きさのまま",
+    )
+    stamp_scale_jitter: bpy.props.FloatProperty(
+        name="scale jitter",
+        default=0.3,
+        min=0,
+        max=1,
+        subtype="FACTOR",
+        description="スタンプごとの大きさのばらつき",
+    )
+    use_stamp_rotation: bpy.props.BoolProperty(
+        name="stamp rotation",
+        default=True,
+        description="視線方向を軸にスタンプをランダムに回す",
+    )
+    use_surface: bpy.props.BoolProperty(
+        name="project to surface",
+        default=False,
+        description="surface_targetのメッシュの表面に投影する 当たらなかったポイントは捨てる",
+    )
+    surface_target: bpy.props.EnumProperty(
+        name="surface target",
+        items=surface_cache.SURFACE_TARGETS,
+        default="SELECTED",
+        description="投影先にするメッシュ",
+    )
+    surface_collection: bpy.props.StringProperty(
+        name="surface collection",
+        default="",
+        description="surface_targetがcollectionのときに使うコレクションの名前",
+    )
+    surface_offset: bpy.props.FloatProperty(
+        name="surface offset",
+        default=0.0,
+        soft_min=-1,
+        soft_max=1,
+        description="表面から法線方向に浮かせる距離",
+    )
+    use_min_distance: bpy.props.BoolProperty(
+        name="min distance",
+        default=False,
+        description="ポイント同士がmin_distanceより近づかないように間引く(ブルーノイズ)",
+    )
+    min_distance: bpy.props.FloatProperty(
+        name="distance",
+        default=0.01,
+        min=0.0001,
+        soft_max=1,
+        description="ポイント間の最小距離(ワールド単位)",
+    )
+    max_per_cell: bpy.props.IntProperty(
+        name="max per cell",
+        default=0,
+        min=0,
+        soft_max=8,
+        description="min_distance四方のセルあたりのポイント数の上限 0で無制限",
+    )
+    use_color: bpy.props.BoolProperty(
+        name="sample color",
+        default=False,
+        description="開始時のビューポートか画像から各ポイントの頂点カラーを拾う",
+    )
+    color_source: bpy.props.EnumProperty(
+        name="color source",
+        items=(
+            ("VIEWPORT", "viewport", "開始時のビューポートのスナップショット"),
+            ("IMAGE", "image", "画像を画面に合わせて引き伸ばしたもの"),
+        ),
+        default="VIEWPORT",
+    )
+    color_image: bpy.props.StringProperty(
+        name="color image", default="", description="color_sourceがimageのときに使う画像の名前"
+    )
+    color_factor: bpy.props.FloatProperty(
+        name="color factor",
+        default=1.0,
+        min=0,
+        max=1,
+        subtype="FACTOR",
+        description="頂点カラーの混ぜ具合",
+    )
+    use_material_map: bpy.props.BoolProperty(
+        name="map to materials",
+        default=False,
+        description="拾った色に一番近い色のマテリアルのストロークに振り分ける sample colorが必要",
+    )
+    map_image: bpy.props.StringProperty(
+        name="map image",
+        default="",
+        description="密度/半径/強さを変える画像の名前 輝度x アルファの値を使う",
+    )
+    map_space: bpy.props.EnumProperty(
+        name="map space",
+        items=(
+            ("SCREEN", "screen", "画像を画面に合わせて引き伸ばす"),
+            ("WORLD", "world", "画像をワールドのXY平面にmap_scale四方でタイルする"),
+        ),
+        default="SCREEN",
+    )
+    map_scale: bpy.props.FloatProperty(
+        name="map scale",
+        default=1.0,
+        min=0.0001,
+        soft_max=100,
+        description="worldモードで画像1枚が覆う大きさ(ワールド単位)",
+    )
+    use_map_density: bpy.props.BoolProperty(
+        name="map density", default=True, description="画像の値を確率にしてポイントを残す"
+    )
+    use_map_radius: bpy.props.BoolProperty(
+        name="map radius", default=False, description="中心の画像の値を散布半径に掛ける"
+    )
+    use_map_strength: bpy.props.BoolProperty(
+        name="map strength", default=False, description="画像の値をポイントの強さにする"
+    )
+    commit_mode: bpy.props.EnumProperty(
+        name="commit mode",
+        items=(
+            ("IMMEDIATE", "immediate", "ティックごとにストロークに書き込む"),
+            ("DEFERRED", "deferred", "ポイントを溜めておいてまとめて書き込む"),
+        ),
+        default="IMMEDIATE",
+        description="ストロークに書き込む頻度",
+    )
+    commit_ticks: bpy.props.IntProperty(
+        name="commit ticks",
+        default=5,
+        min=0,
+        soft_max=60,
+        description="deferredでこのティック数ごとに書き込む 0なら数えない",
+    )
+    commit_points: bpy.props.IntProperty(
+        name="commit points",
+        default=2000,
+        min=0,
+        soft_max=100000,
+        description="deferredで溜まったポイントがこの数を超えたら書き込む 0なら数えない",
+    )
+    use_preview: bpy.props.BoolProperty(
+        name="preview",
+        default=True,
+        description="deferredでまだ書き込んでいないポイントをオーバーレイで表示する",
+    )
+    use_decimate: bpy.props.BoolProperty(
+        name="decimate on release",
+        default=False,
+        description="離したときにこのドラッグで打ったポイントの重なりを間引く",
+    )
+    decimate_tolerance: bpy.props.FloatProperty(
+        name="decimate tolerance",
+        default=0.005,
+        min=0.00001,
+        soft_max=0.1,
+        description="この大きさのセルに入るポイントを1点にする(ワールド単位)",
+    )
+    decimate_mode: bpy.props.EnumProperty(
+        name="decimate mode", items=ops_decimate_gpencil.DECIMATE_MODES, default="DROP"
+    )
+    max_points_per_stroke: bpy.props.IntProperty(
+        name="max points per stroke",
+        default=2000,
+        min=0,
+        soft_max=20000,
+        description="1ストロークのポイント数の上限 超えたら新しいストロークに切り替える 0で無制限",
+    )
 
     _timer = None
+    _strokes: bpy.types.GPencilStrokes = None
     _stroke: bpy.types.GPencilStroke = None
+    _material_index = 0
+    # 開始前からあったストロークの数 これより後ろがこのドラッグで作ったもの
+    _first_stroke = 0
     _obj: bpy.types.Object = None
     _i_matrix = None
+    _i_matrix_np: "np.ndarray" = None
+    _writer: StrokeWriter = None
+    # マテリアル番号 -> 今書き込んでいるStrokeWriter
+    _writers: dict = None
+    _material_lut: "color_core.ColorLUT" = None
+    _material_slots: "np.ndarray" = None
+    # np.random.Generatorと同じように使えるRandomPool
+    _rng: "rng_pool.RandomPool" = None
+    _path_points: list = None
+    _path_pressures: list = None
+    _path_carry = 0.0
+    _view: ViewCache = None
+    _spatial_hash: "scatter_core.SpatialHash" = None
+    _stamp_bank: "scatter_core.StampBank" = None
+    _surface_objects: list = None
+    _depsgraph: bpy.types.Depsgraph = None
+    _color_pixels: "np.ndarray" = None
+    _color_matrix: "np.ndarray" = None
+    _color_is_srgb: bool = False
+    _metrics: "tick_metrics.TickMetrics" = None
+    _scheduler: "tick_scheduler.TickScheduler" = None
+    _staging: "scatter_core.StagingBuffer" = None
+    _ticks_since_commit = 0
+    # 最後のcommitの時間をそれまでのティック数で割ったもの
+    _commit_share = 0.0
+    _draw_handler = None
+    _preview_batch = None
+    _preview_version = -1
+    _timer_interval = 0.0
+    # 今のティックの [location, generate, write, points]
+    _phase: list = None
+    # 今のティックで作った候補のポイント数 密度マップなどで捨てる前の数
+    _generated = 0
+    _last_tick = 0.0
+
+    def new_stroke(self, material_index: int = None) -> bpy.types.GPencilStroke:
+        """
+        マテリアル(省略したらアクティブ)と太さを設定した新しいストロークを作って
+        そのマテリアルの書き込み先を切り替える
+        """
+        if material_index is None:
+            material_index = self._material_index
+        stroke: bpy.types.GPencilStroke = self._strokes.new()
+        stroke.material_index = material_index
+        stroke.line_width = self.size
+        self._stroke = stroke
+        self._writer = self._writers[material_index] = StrokeWriter(stroke)
+        return stroke
+
+    def write_points(
+        self,
+        co: "np.ndarray",
+        pressure: "np.ndarray",
+        strength: "np.ndarray",
+        vertex_color: "np.ndarray" = None,
+        material_index: int = None,
+    ):
+        """max_points_per_strokeを超える分は新しいストロークに分けて書き込む"""
+        if material_index is None:
+            material_index = self._material_index
+        limit = self.max_points_per_stroke
+        total = len(co)
+        start = 0
+        writer = self._writers.get(material_index)
+        while start < total:
+            if writer is None or (limit and len(writer) >= limit):
+                self.new_stroke(material_index)
+                writer = self._writer
+            end = total if not limit else min(total, start + limit - len(writer))
+            writer.append(
+                co[start:end],
+                pressure[start:end],
+                strength[start:end],
+                None if vertex_color is None else vertex_color[start:end],
+            )
+            start = end
+
+    def scatter_points(self, centers: "np.ndarray", pressure: "np.ndarray"):
+        """centersの各位置に1ポイントずつ散布して書き込む"""
+        count = len(centers)
+        if count == 0:
+            return
+        start = perf_counter()
+        map_pixels = self.get_map_pixels()
+        radius = None
+        if map_pixels is not None and self.use_map_radius:
+            radius = self.map_values(map_pixels, centers)
+        if self.scatter_space == "SCREEN":
+            locations = self.scatter_screen(centers, radius)
+        elif self.scatter_rate == 0:
+            locations = centers
+        else:
+            offsets = scatter_core.generate_offsets(
+                self.distribution, count, self.scatter_rate, self._rng
+            )
+            if radius is not None:
+                offsets *= radius[:, None]
+            locations = centers + offsets
+        if self._stamp_bank is not None:
+            locations, owner = self.place_stamps(locations, radius)
+            pressure = pressure[owner]
+            count = len(locations)
+        self._generated += count
+        if map_pixels is not None and self.use_map_density:
+            keep = self._rng.random(count) < self.map_values(map_pixels, locations)
+            locations = locations[keep]
+            pressure = pressure[keep]
+        if self.use_surface:
+            locations, hit = self.project_to_surface(locations)
+            locations = locations[hit]
+            pressure = pressure[hit]
+        if self._spatial_hash is not None:
+            accepted = self._spatial_hash.insert(locations)
+            locations = locations[accepted]
+            pressure = pressure[accepted]
+        local_locations = scatter_core.transform_points(self._i_matrix_np, locations)
+        if map_pixels is not None and self.use_map_strength:
+            strength = self.map_values(map_pixels, locations)
+        else:
+            strength = np.ones(len(locations))
+        vertex_color = None
+        if self._color_pixels is not None:
+            vertex_color = self.sample_color(locations)
+        generated = perf_counter()
+        if self._staging is not None:
+            self._staging.append(local_locations, pressure, strength, vertex_color)
+        else:
+            self.write_by_material(local_locations, pressure, strength, vertex_color)
+        phase = self._phase
+        phase[1] += generated - start
+        phase[2] += perf_counter() - generated
+        phase[3] += len(local_locations)
+
+    def write_by_material(
+        self,
+        co: "np.ndarray",
+        pressure: "np.ndarray",
+        strength: "np.ndarray",
+        vertex_color: "np.ndarray" = None,
+    ):
+        """map to materialsのときは色からLUTで引いたマテリアルごとに分けて書き込む"""
+        lut = self._material_lut
+        if lut is None or vertex_color is None:
+            self.write_points(co, pressure, strength, vertex_color)
+            return
+        # LUTはsRGBで作ってあるのでリニアの色を戻して引く
+        srgb = color_core.linear_to_srgb(vertex_color[:, :3])
+        slots = self._material_slots[lut.lookup(srgb)]
+        for material_index in np.unique(slots):
+            mask = slots == material_index
+            self.write_points(
+                co[mask],
+                pressure[mask],
+                strength[mask],
+                vertex_color[mask],
+                int(material_index),
+            )
+
+    def commit(self):
+        """溜めたポイントを1回のpoints.addとforeach_setでストロークに書き込む"""
+        staging = self._staging
+        self._ticks_since_commit = 0
+        if staging is None or len(staging) == 0:
+            return
+        start = perf_counter()
+        self.write_by_material(
+            staging.co,
+            staging.pressure,
+            staging.strength,
+            staging.vertex_color if staging.use_color else None,
+        )
+        staging.clear()
+        logger.debug("commit: %.3fs", perf_counter() - start)
+
+    def should_commit(self) -> bool:
+        self._ticks_since_commit += 1
+        if self.commit_ticks and self._ticks_since_commit >= self.commit_ticks:
+            return True
+        return bool(self.commit_points and len(self._staging) >= self.commit_points)
+
+    def draw_preview(self):
+        """まだ書き込んでいないポイントをオブジェクトの行列で点として描く"""
+        staging = self._staging
+        if staging is None or len(staging) == 0:
+            return
+        shader = gpu.shader.from_builtin("3D_UNIFORM_COLOR")
+        if self._preview_version != staging.version:
+            self._preview_batch = gpu_batch.batch_for_shader(
+                shader, "POINTS", {"pos": staging.co}
+            )
+            self._preview_version = staging.version
+        gpu.state.point_size_set(3)
+        gpu.matrix.push()
+        gpu.matrix.multiply_matrix(self._obj.matrix_world)
+        shader.bind()
+        shader.uniform_float("color", (1.0, 0.5, 0.0, 0.8))
+        self._preview_batch.draw(shader)
+        gpu.matrix.pop()
+
+    def place_stamps(self, centers: "np.ndarray", radius: "np.ndarray" = None):
+        """
+        centersにスタンプを1つずつ置く 回転と拡大は1回のeinsumでまとめて計算する
+        (配置した点, 各点がどのcentersのものか)を返す
+        """
+        bank = self._stamp_bank
+        count = len(centers)
+        scale = self.stamp_size if self.stamp_source == "PROCEDURAL" else 1.0
+        axis = self._view.view_normal if self.use_stamp_rotation else None
+        matrices = scatter_core.stamp_matrices(
+            count, self._rng, scale, self.stamp_scale_jitter, axis
+        )
+        if radius is not None:
+            matrices *= radius[:, None, None]
+        indices = self._rng.integers(0, len(bank), count)
+        return bank.place(indices, centers, matrices)
+
+    def load_stamp_bank(self, obj: bpy.types.Object) -> "scatter_core.StampBank":
+        """
+        スタンプを用意する proceduralは同じ設定ならscatter_coreのキャッシュを使い回す
+        strokesは選択中のストロークをワールド座標にして1本ずつスタンプにする
+        """
+        if not self.use_stamp:
+            return None
+        if self.stamp_source == "PROCEDURAL":
+            return scatter_core.procedural_stamp_bank(
+                self.distribution, self.stamp_points, self.stamp_variants
+            )
+        strokes = self._strokes
+        select = np.empty(len(strokes), dtype=bool)
+        strokes.foreach_get("select", select)
+        data = gp_snapshot.take_strokes(gp_snapshot.read_strokes(strokes), select)
+        co = scatter_core.transform_points(np.array(obj.matrix_world), data["co"])
+        try:
+            return scatter_core.StampBank(np.split(co, data["stroke_offsets"][1:-1]))
+        except ValueError:
+            self.report({"WARNING"}, "no selected strokes for stamp")
+            return None
+
+    def get_map_pixels(self) -> "np.ndarray":
+        """マップ画像のピクセル image_cacheで読み直しは更新されたときだけになる"""
+        if not self.map_image:
+            return None
+        image = bpy.data.images.get(self.map_image)
+        if image is None or image.size[0] == 0:
+            return None
+        return image_cache.get_pixels(image)
+
+    def map_values(
+        self, map_pixels: "np.ndarray", locations: "np.ndarray"
+    ) -> "np.ndarray":
+        """ワールド座標(N, 3)の位置のマップの値(N,)をまとめて引く"""
+        if self.map_space == "WORLD":
+            uv = (locations[:, :2] / self.map_scale) % 1.0
+        else:
+            size = self._view.size
+            coords, _ = scatter_core.project_to_region(
+                locations, self._view.perspective_matrix, *size
+            )
+            uv = coords / size
+        return color_core.luminance(color_core.sample_image(map_pixels, uv))
+
+    def scatter_screen(self, centers: "np.ndarray", radius: "np.ndarray" = None):
+        """
+        centersを画面に投影してscreen_radiusの円内にばらし、まとめて逆投影する
+        radiusがあればcentersごとの半径の倍率として掛ける
+        """
+        view = self._view
+        coords, _ = scatter_core.project_to_region(
+            centers, view.perspective_matrix, *view.size
+        )
+        offsets = scatter_core.generate_offsets(
+            "DISC", len(centers), self.screen_radius, self._rng
+        )
+        if radius is not None:
+            offsets *= radius[:, None]
+        coords += offsets[:, :2]
+        return view.locations3d(coords)
+
+    def project_to_surface(self, locations: "np.ndarray"):
+        """
+        視点から各ポイントを通るレイをまとめてメッシュに当てる
+        (表面上の位置, 当たったかのマスク)を返す
+        """
+        view = self._view
+        coords, visible = scatter_core.project_to_region(
+            locations, view.perspective_matrix, *view.size
+        )
+        ndc = scatter_core.region_to_ndc(coords, *view.size)
+        origins, directions = scatter_core.view_rays(ndc, view.perspective_matrix_inv)
+        hits, normals, hit = surface_cache.ray_cast_batch(
+            self._surface_objects, self._depsgraph, origins, directions
+        )
+        if self.surface_offset != 0:
+            hits += normals * self.surface_offset
+        return hits, hit & visible
+
+    def sample_color(self, locations: "np.ndarray") -> "np.ndarray":
+        """開始時のビューで投影した位置からスナップショットの色をまとめて拾う"""
+        size = self._view.size
+        coords, _ = scatter_core.project_to_region(
+            locations, self._color_matrix, *size
+        )
+        vertex_color = color_core.sample_image(self._color_pixels, coords / size)
+        vertex_color = np.array(vertex_color, dtype=np.float32)
+        # vertex_colorはリニアなので画面やsRGBの画像から拾った色は変換しておく
+        if self._color_is_srgb:
+            vertex_color[:, :3] = color_core.srgb_to_linear(vertex_color[:, :3])
+        vertex_color[:, 3] = self.color_factor
+        return vertex_color
+
+    def snapshot_color(self):
+        """色を拾う元をここで一回だけ読んでおく"""
+        self._color_pixels = None
+        if not self.use_color:
+            return
+        if self.color_source == "IMAGE":
+            image = bpy.data.images.get(self.color_image)
+            if image is None:
+                self.report({"WARNING"}, f"image not found: {self.color_image}")
+                return
+            self._color_pixels = image_cache.get_pixels(image)
+            # floatの画像のピクセルはリニア 8bitの画像は色空間のまま読まれる
+            self._color_is_srgb = (
+                not image.is_float and image.colorspace_settings.name == "sRGB"
+            )
+        else:
+            # フロントバッファはディスプレイのsRGB
+            self._color_pixels = ops_capture_color.capture_region(self._view.region)
+            self._color_is_srgb = True
+        self._color_matrix = self._view.perspective_matrix.copy()
+
+    def scatter_batch(self, world_location: mathutils.Vector, event: bpy.types.Event):
+        """1ドロー分のポイントをまとめて生成して書き込む"""
+        count = self.tick_count()
+        centers = np.tile(np.array(world_location), (count, 1))
+        pressure = np.full(count, event.pressure if event.is_tablet else 1.0)
+        self.scatter_points(centers, pressure)
+
+    def tick_count(self) -> int:
+        """timerモードで1ドローに置く数 スタンプのときはスタンプの個数"""
+        scheduler = self._scheduler
+        bank = self._stamp_bank
+        if scheduler is None:
+            return self.count if bank is None else self.stamp_count
+        if bank is None:
+            return scheduler.count
+        # スケジューラの数はポイント数なのでスタンプの平均ポイント数で割る
+        return max(1, round(scheduler.count * len(bank) / len(bank.points)))
+
+    def buffer_path(self, context, event):
+        """MOUSEMOVEの位置と筆圧を次のタイマーまで溜めておく"""
+        start = perf_counter()
+        self._view.validate()
+        self._path_points.append(self._view.location3d(event))
+        self._path_pressures.append(event.pressure if event.is_tablet else 1.0)
+        self._phase[0] += perf_counter() - start
+
+    def flush_path(self):
+        """溜めた軌跡をspacing間隔でサンプルして散布する"""
+        if not self._path_points:
+            return
+        centers, pressure, self._path_carry = scatter_core.resample_polyline(
+            self._path_points, self._path_pressures, self.spacing, self._path_carry
+        )
+        # 最後の位置は次の軌跡の始点として残す
+        del self._path_points[:-1]
+        del self._path_pressures[:-1]
+        self.scatter_points(centers, pressure)
+
+    def tick(self, event: bpy.types.Event):
+        """TIMERごとの処理 かかった時間をフェーズごとに記録する"""
+        start = perf_counter()
+        if self.sample_mode == "PATH":
+            self.flush_path()
+        else:
+            self._view.validate()
+            world_location = self._view.location3d(event)
+            self._phase[0] += perf_counter() - start
+            self.scatter_batch(world_location, event)
+        commit_time = 0.0
+        if self._staging is not None:
+            if self.should_commit():
+                ticks = self._ticks_since_commit
+                commit_start = perf_counter()
+                self.commit()
+                commit_time = perf_counter() - commit_start
+                # まとめて書き込んだ分はそこまでのティックで均したコストにする
+                self._commit_share = commit_time / max(1, ticks)
+            elif self._draw_handler is not None:
+                self._view.area.tag_redraw()
+        self.record_tick(start, commit_time)
+
+    def record_tick(self, start: float, commit_time: float = 0.0):
+        """
+        1ティック分を記録する commit_timeは計測値には別の列で残し、
+        スケジューラにはティックごとに均した分(_commit_share)だけ足して渡す
+        """
+        phase = self._phase
+        elapsed = perf_counter() - start - commit_time
+        interval = start - self._last_tick if self._last_tick else 0.0
+        count = self._scheduler.count if self._scheduler is not None else self.count
+        self._metrics.record(
+            (
+                elapsed,
+                phase[0],
+                phase[1],
+                phase[2],
+                commit_time,
+                phase[3],
+                interval,
+                count,
+                self._timer_interval,
+            )
+        )
+        if self._scheduler is not None:
+            # 書き込んだ数だとmin distanceなどで捨てた分のコストが1ポイントに乗って
+            # countが縮み続けるので作った候補の数で割る
+            self._scheduler.update(elapsed + self._commit_share, self._generated)
+        self._last_tick = start
+        phase[:] = [0.0, 0.0, 0.0, 0]
+        self._generated = 0
+
+    def reschedule(self, context):
+        """スケジューラの決めた間隔が今のタイマーと大きくずれていたらタイマーを作り直す"""
+        scheduler = self._scheduler
+        if scheduler is None or not scheduler.should_reset_timer(self._timer_interval):
+            return
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        self._timer = wm.event_timer_add(scheduler.interval, window=context.window)
+        self._timer_interval = scheduler.interval
 
     def modal(self, context, event):
+        if self.sample_mode == "PATH" and event.type in {
+            "MOUSEMOVE",
+            "INBETWEEN_MOUSEMOVE",
+        }:
+            self.buffer_path(context, event)
+            return {"PASS_THROUGH"}
+
         if event.type == "TIMER":
-            world_location = get_location3d(context, event)
-            # self.report(
-            #     {"INFO"},
-            #     f"location:{world_location}"
-            #     f"pressure:{event.pressure},is_tablet:{event.is_tablet}",
-            # )
-            stroke = self._stroke
-            # countを増やすと1ドローあたりのポイント数が増える　上げすぎると1ストローク2000を超えたあたりから重くなる
-            count = 10
-            stroke.points.add(count)
-            for point in stroke.points[max(0, len(stroke.points) - count) :]:
-                if self.scatter_rate == 0:
-                    location = world_location
-                else:
-                    location = world_location + random_gauss_vector(self.scatter_rate)
-                local_location = self._i_matrix @ location
-                point.co = local_location
-                if event.is_tablet:
-                    point.pressure = event.pressure
-                else:
-                    point.pressure = 1
+            self.tick(event)
+            self.reschedule(context)
             return {"PASS_THROUGH"}
 
-        # 非常終了
+        # 非常終了 書き込み済みのポイントは残るので溜めている分もそろえて書き込む
         if event.type == "ESC":
+            self.commit()
             self.cancel(context)
             self.report({"INFO"}, "canceld")
             return {"CANCELLED"}
 
         if event.type == "LEFTMOUSE":
             if event.value == "RELEASE":
+                if self.sample_mode == "PATH":
+                    self.flush_path()
+                self.commit()
                 self.cancel(context)
+                if self.use_decimate:
+                    self.decimate_session()
                 return {"FINISHED"}
 
         return {"PASS_THROUGH"}
 
+    def decimate_session(self):
+        """このドラッグで作ったストロークをまとめて間引く"""
+        start = perf_counter()
+        strokes = self._strokes
+        mask = np.arange(len(strokes)) >= self._first_stroke
+        # toleranceはワールド単位なのでローカルのスケールに直す
+        tolerance = ops_decimate_gpencil.local_tolerance(
+            self._obj, self.decimate_tolerance
+        )
+        if tolerance <= 0:
+            return
+        before, after = ops_decimate_gpencil.decimate_strokes(
+            strokes, mask, tolerance, self.decimate_mode == "MERGE"
+        )
+        logger.debug(
+            "decimate: %d -> %d points %.3fs", before, after, perf_counter() - start
+        )
+
     def invoke(self, context, event):
         if context.area.type == "VIEW_3D":
             if context.active_object.type == "GPENCIL":
@@ -155,22 +946,87 @@ class ScatterGpencilOps(bpy.types.Operator):
                 # タイマー設定
                 rate = 1 / self.draw_rate
                 self._timer = wm.event_timer_add(rate, window=context.window)
+                self._timer_interval = rate
+                # adaptiveのときはdraw_rateの間隔から始めて計測しながら決め直す
+                self._scheduler = None
+                if self.use_scheduler and self.sample_mode == "TIMER":
+                    self._scheduler = tick_scheduler.TickScheduler(
+                        self.tick_budget / 1000, self.points_per_second, rate
+                    )
                 wm.modal_handler_add(self)
                 # アクティブレイヤーの取得とストローク生成
                 self.report({"INFO"}, str(context.active_gpencil_layer.info))
                 layer = context.active_gpencil_layer
-                strokes = layer.active_frame.strokes
-                new_stroke: bpy.types.GPencilStroke = strokes.new()
+                self._strokes = layer.active_frame.strokes
+                self._first_stroke = len(self._strokes)
                 # アクティブマテリアルを割り当て
-                material_index = bpy.context.object.active_material_index
-                new_stroke.material_index = material_index
-                # 太さを設定
-                new_stroke.line_width = self.size
-                # 諸々保存
+                self._material_index = bpy.context.object.active_material_index
+                # スタンプは選択中のストロークから作ることがあるので新しいストロークより先に用意する
                 obj: bpy.types.Object = context.active_object
-                self._stroke = new_stroke
+                self._stamp_bank = self.load_stamp_bank(obj)
+                # 色でマテリアルを振り分けるときのLUT マテリアルの色が変わったときだけ作り直す
+                self._material_lut = self._material_slots = None
+                if self.use_material_map and self.use_color:
+                    self._material_lut, self._material_slots = material_cache.get_lut(
+                        obj
+                    )
+                # 太さも含めてnew_strokeで設定される
+                # 上限で分割されたストロークもモーダル全体で1回のundoにまとまる
+                # 振り分けるときは使うマテリアルのストロークを書くときに作る
+                self._writers = {}
+                self._stroke = self._writer = None
+                if self._material_lut is None:
+                    self.new_stroke()
+                # 諸々保存
                 self._obj = obj
                 self._i_matrix = mathutils.Matrix(obj.matrix_world).inverted_safe()
+                self._i_matrix_np = np.array(self._i_matrix)
+                self._rng = get_random_pool()
+                # 計測 パネルから見られるようにモジュールにも置いておく
+                global last_metrics
+                self._metrics = tick_metrics.TickMetrics(
+                    requested_rate=self.draw_rate
+                )
+                last_metrics = self._metrics
+                self._phase = [0.0, 0.0, 0.0, 0]
+                self._generated = 0
+                self._last_tick = 0.0
+                # カーソル下のビューを決めてセッション中はキャッシュを使う
+                self._view = ViewCache(*find_view3d_under_cursor(context, event))
+                self.snapshot_color()
+                # deferredのときは溜めておいてまとめて書き込む
+                self._staging = None
+                self._ticks_since_commit = 0
+                self._commit_share = 0.0
+                self._draw_handler = None
+                self._preview_version = -1
+                if self.commit_mode == "DEFERRED":
+                    self._staging = scatter_core.StagingBuffer()
+                    if self.use_preview and not bpy.app.background:
+                        self._draw_handler = bpy.types.SpaceView3D.draw_handler_add(
+                            self.draw_preview, (), "WINDOW", "POST_VIEW"
+                        )
+                # 投影先のメッシュ BVHTreeはsurface_cacheで使い回される
+                self._depsgraph = context.evaluated_depsgraph_get()
+                self._surface_objects = []
+                if self.use_surface:
+                    self._surface_objects = surface_cache.target_objects(
+                        context, self.surface_target, self.surface_collection
+                    )
+                    if not self._surface_objects:
+                        self.report({"WARNING"}, "no surface objects")
+                # ドラッグ中に打った点はすべて同じグリッドで間引く
+                self._spatial_hash = None
+                if self.use_min_distance:
+                    self._spatial_hash = scatter_core.SpatialHash(
+                        self.min_distance, self.max_per_cell
+                    )
+                # 押した位置から軌跡を始める carryをspacingにしておくと始点にも散布される
+                self._path_points = []
+                self._path_pressures = []
+                self._path_carry = self.spacing
+                if self.sample_mode == "PATH":
+                    self.buffer_path(context, event)
 
                 return {"RUNNING_MODAL"}
         self.cancel(context)
@@ -180,6 +1036,81 @@ class ScatterGpencilOps(bpy.types.Operator):
         wm = context.window_manager
         wm.event_timer_remove(self._timer)
         self._timer = None
+        if self._draw_handler is not None:
+            bpy.types.SpaceView3D.draw_handler_remove(self._draw_handler, "WINDOW")
+            self._draw_handler = None
+            self._preview_batch = None
+            self._view.area.tag_redraw()
+
+
+class ScatterGpencilMetricsDump(bpy.types.Operator, ExportHelper):
+    """最後の散布セッションの計測値をjsonに書き出す"""
+
+    bl_idname = "gpencil.scatter_metrics_dump"
+    bl_label = "dump scatter metrics"
+    bl_description = "最後の散布セッションの計測値をjsonに書き出す"
+
+    filename_ext = ".json"
+    filter_glob: bpy.props.StringProperty(default="*.json", options={"HIDDEN"})
+
+    @classmethod
+    def poll(cls, context):
+        return last_metrics is not None
+
+    def execute(self, context):
+        last_metrics.dump(self.filepath)
+        self.report({"INFO"}, f"dump metrics: {self.filepath}")
+        return {"FINISHED"}
+
+
+class SCATTER_PT_TickMetrics(bpy.types.Panel):
+    bl_label = "ScatterMetrics"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+
+    def draw(self, context):
+        layout = self.layout
+        if last_metrics is None or len(last_metrics) == 0:
+            layout.label(text="no scatter session")
+            return
+        summary = last_metrics.summary()
+        layout.label(text=f"ticks: {summary['ticks']}")
+        layout.label(
+            text=f"rate: {summary['actual_rate']:.1f} / {summary['requested_rate']:.1f} per sec"
+        )
+        points = summary["points"]
+        layout.label(
+            text=f"points: p50 {points['p50']:.0f} p95 {points['p95']:.0f} max {points['max']:.0f}"
+        )
+        col = layout.column(align=True)
+        for field in ("total", "location", "generate", "write", "commit"):
+            values = summary[field]
+            col.label(
+                text=f"{field}: p50 {values['p50'] * 1000:.2f}"
+                f" p95 {values['p95'] * 1000:.2f} max {values['max'] * 1000:.2f} ms"
+            )
+        # adaptiveのときにスケジューラが選んだ値
+        count = summary["count"]
+        timer = summary["timer"]
+        col = layout.column(align=True)
+        col.label(text=f"count: p50 {count['p50']:.0f} max {count['max']:.0f}")
+        col.label(
+            text=f"timer: p50 {timer['p50'] * 1000:.1f} max {timer['max'] * 1000:.1f} ms"
+        )
+        layout.operator(ScatterGpencilMetricsDump.bl_idname)
+
+
+def draw_group(layout, props, toggle: str, *names: str):
+    """
+    toggleのプロパティと、それが有効なときだけnamesのプロパティを1つのまとまりとして並べる
+    続けて項目を足せるように作ったcolumnを返す
+    """
+    col = layout.column(align=True)
+    col.prop(props, toggle)
+    if getattr(props, toggle):
+        for name in names:
+            col.prop(props, name)
+    return col
 
 
 class ScatterGpencilTool(bpy.types.WorkSpaceTool):
@@ -205,24 +1136,97 @@ class ScatterGpencilTool(bpy.types.WorkSpaceTool):
 
     def draw_settings(context, layout, tool):
         props = tool.operator_properties("gpencil.scatter_ops")
-        layout.prop(props, "draw_rate")
-        layout.prop(props, "scatter_rate")
-        layout.prop(props, "size")
+        col = layout.column(align=True)
+        col.prop(props, "draw_rate")
+        col.prop(props, "size")
+        col.prop(props, "count")
+        col.prop(props, "distribution")
+        col.prop(props, "scatter_space")
+        if props.scatter_space == "SCREEN":
+            col.prop(props, "screen_radius")
+        else:
+            col.prop(props, "scatter_rate")
+
+        col = layout.column(align=True)
+        col.prop(props, "sample_mode")
+        if props.sample_mode == "PATH":
+            col.prop(props, "spacing")
+        else:
+            draw_group(col, props, "use_scheduler", "tick_budget", "points_per_second")
+
+        col = draw_group(layout, props, "use_stamp", "stamp_source")
+        if props.use_stamp:
+            if props.stamp_source == "PROCEDURAL":
+                col.prop(props, "stamp_points")
+                col.prop(props, "stamp_variants")
+                col.prop(props, "stamp_size")
+            col.prop(props, "stamp_count")
+            col.prop(props, "stamp_scale_jitter")
+            col.prop(props, "use_stamp_rotation")
+
+        col = draw_group(layout, props, "use_surface", "surface_target")
+        if props.use_surface:
+            if props.surface_target == "COLLECTION":
+                col.prop(props, "surface_collection")
+            col.prop(props, "surface_offset")
 
+        draw_group(layout, props, "use_min_distance", "min_distance", "max_per_cell")
 
-classses = [ScatterGpencilOps]
+        col = draw_group(layout, props, "use_color", "color_source")
+        if props.use_color:
+            if props.color_source == "IMAGE":
+                col.prop(props, "color_image")
+            col.prop(props, "color_factor")
+            col.prop(props, "use_material_map")
+
+        col = layout.column(align=True)
+        col.prop(props, "map_image")
+        if props.map_image:
+            col.prop(props, "map_space")
+            if props.map_space == "WORLD":
+                col.prop(props, "map_scale")
+            col.prop(props, "use_map_density")
+            col.prop(props, "use_map_radius")
+            col.prop(props, "use_map_strength")
+
+        col = layout.column(align=True)
+        col.prop(props, "commit_mode")
+        if props.commit_mode == "DEFERRED":
+            col.prop(props, "commit_ticks")
+            col.prop(props, "commit_points")
+            col.prop(props, "use_preview")
+        col.prop(props, "max_points_per_stroke")
+
+        draw_group(layout, props, "use_decimate", "decimate_tolerance", "decimate_mode")
+
+
+classses = [ScatterGpencilOps, ScatterGpencilMetricsDump]
+# UIがあるときだけ登録するもの blender -bでは登録しない
+panels = [SCATTER_PT_TickMetrics]
 tools = [ScatterGpencilTool]
 
 
 def register():
     for c in classses:
         bpy.utils.register_class(c)
+    if bpy.app.background:
+        return
+    for c in panels:
+        bpy.utils.register_class(c)
     for t in tools:
         bpy.utils.register_tool(t)
 
 
 def unregister():
+    global _random_pool
+    if _random_pool is not None:
+        _random_pool.stop()
+        _random_pool = None
     for c in classses:
         bpy.utils.unregister_class(c)
+    if bpy.app.background:
+        return
+    for c in panels:
+        bpy.utils.unregister_class(c)
     for t in tools:
         bpy.utils.unregister_tool(t)
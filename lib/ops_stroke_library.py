@@ -0,0 +1,213 @@
+"""
+散布用の素材ストロークをディスクのライブラリに書き出す/読み込む
+ライブラリはgp_snapshotの列ごとに.npyを置いたフォルダで、読み込みはmemmapで必要な範囲だけ読む
+座標はワールド座標で保存して、読み込むときにオブジェクトのローカルに直す
+"""
+import bpy
+import json
+import mathutils
+import os
+from bpy_extras.io_utils import ExportHelper, ImportHelper
+from logging import getLogger
+from . import gp_snapshot
+from . import scatter_core
+from .standalone import lazy_import
+from .util import get_or_create_frame
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+translation = bpy.app.translations.pgettext
+
+LIBRARY_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+COLUMNS = ("stroke_offsets",) + tuple(
+    name for name, _, _ in gp_snapshot.STROKE_ATTRIBUTES + gp_snapshot.POINT_ATTRIBUTES
+)
+
+
+def save_library(dirpath: str, data: dict):
+    """列ごとに.npyを書き出してmanifest.jsonを置く"""
+    os.makedirs(dirpath, exist_ok=True)
+    for name in COLUMNS:
+        np.save(os.path.join(dirpath, name + ".npy"), np.ascontiguousarray(data[name]))
+    manifest = {
+        "version": LIBRARY_VERSION,
+        "strokes": len(data["stroke_offsets"]) - 1,
+        "points": int(data["stroke_offsets"][-1]),
+        "columns": list(COLUMNS),
+    }
+    with open(os.path.join(dirpath, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_library(path: str) -> dict:
+    """
+    ライブラリのフォルダ(かその中のmanifest.json)を開いて列をmemmapで返す
+    この時点ではファイルの中身はほとんど読まない
+    """
+    dirpath = os.path.dirname(path) if os.path.isfile(path) else path
+    with open(os.path.join(dirpath, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != LIBRARY_VERSION:
+        raise ValueError(f"unsupported library version: {manifest.get('version')}")
+    return {
+        name: np.load(os.path.join(dirpath, name + ".npy"), mmap_mode="r")
+        for name in manifest["columns"]
+    }
+
+
+def chunk_ranges(offsets, chunk_points: int):
+    """ポイント数がだいたいchunk_pointsになるようにストロークの範囲(first, last)を返す"""
+    offsets = np.asarray(offsets)
+    count = len(offsets) - 1
+    first = 0
+    while first < count:
+        last = np.searchsorted(offsets, offsets[first] + chunk_points, side="right") - 1
+        # 1本でchunk_pointsを超えるストロークもそのまま1チャンクにする
+        last = min(max(int(last), first + 1), count)
+        yield first, last
+        first = last
+
+
+def collect_strokes(obj: bpy.types.Object, selected_only: bool = False) -> dict:
+    """表示中のレイヤーのアクティブフレームのストロークをワールド座標で集める"""
+    matrix = np.array(obj.matrix_world)
+    parts = []
+    for layer in obj.data.layers:
+        frame = layer.active_frame
+        if layer.hide or frame is None:
+            continue
+        data = gp_snapshot.read_strokes(frame.strokes)
+        if selected_only:
+            select = np.empty(len(frame.strokes), dtype=bool)
+            frame.strokes.foreach_get("select", select)
+            data = gp_snapshot.take_strokes(data, select)
+        parts.append(data)
+    data = gp_snapshot.concatenate(parts)
+    data["co"] = scatter_core.transform_points(matrix, data["co"]).astype(np.float32)
+    return data
+
+
+def import_library(
+    obj: bpy.types.Object,
+    frame: bpy.types.GPencilFrame,
+    data: dict,
+    material_index: int = None,
+    chunk_points: int = 1000000,
+) -> int:
+    """
+    load_libraryの結果をobjのローカル座標にしてframeに書き込む
+    chunk_pointsずつmemmapから読んで書くので全体をメモリに載せない
+    material_indexを渡すと保存されているものの代わりに全ストロークでそれを使う
+    書き込んだポイント数を返す
+    """
+    i_matrix = np.array(mathutils.Matrix(obj.matrix_world).inverted_safe())
+    offsets = np.asarray(data["stroke_offsets"])
+    for first, last in chunk_ranges(offsets, chunk_points):
+        chunk = gp_snapshot.slice_strokes(data, first, last)
+        chunk["co"] = scatter_core.transform_points(i_matrix, chunk["co"])
+        gp_snapshot.write_strokes(frame.strokes, chunk, stroke_attributes=False)
+    # ストロークの属性は書くたびにコレクション全体を読み書きするので最後に1回だけ書く
+    if material_index is not None:
+        data = dict(data, material_index=np.full(len(offsets) - 1, material_index))
+    gp_snapshot.write_stroke_attributes(frame.strokes, data)
+    return int(offsets[-1] - offsets[0])
+
+
+class ScatterGpencilLibraryExport(bpy.types.Operator, ExportHelper):
+    """現在のフレームのストロークをライブラリに書き出す"""
+
+    bl_idname = "gpencil.stroke_library_export"
+    bl_label = "export stroke library"
+    bl_description = (
+        "現在のフレームか選択中のストロークを散布素材のライブラリとして書き出す"
+    )
+
+    # ライブラリはこの名前のフォルダになる
+    filename_ext = ".strokelib"
+    filter_glob: bpy.props.StringProperty(default="*.strokelib", options={"HIDDEN"})
+    selected_only: bpy.props.BoolProperty(
+        name="selected only", default=True, description="選択中のストロークだけ書き出す"
+    )
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type == "GPENCIL"
+
+    def execute(self, context):
+        data = collect_strokes(context.active_object, self.selected_only)
+        if len(data["stroke_offsets"]) <= 1:
+            self.report({"WARNING"}, "no strokes")
+            return {"CANCELLED"}
+        save_library(self.filepath, data)
+        self.report(
+            {"INFO"},
+            f"{len(data['stroke_offsets']) - 1} strokes, "
+            f"{data['stroke_offsets'][-1]} points: {self.filepath}",
+        )
+        return {"FINISHED"}
+
+
+class ScatterGpencilLibraryImport(bpy.types.Operator, ImportHelper):
+    """ライブラリのストロークをアクティブレイヤーの現在のフレームに読み込む"""
+
+    bl_idname = "gpencil.stroke_library_import"
+    bl_label = "import stroke library"
+    bl_description = "散布素材のライブラリ(.strokelibのmanifest.json)を読み込む"
+    bl_options = {"REGISTER", "UNDO"}
+
+    filter_glob: bpy.props.StringProperty(default=MANIFEST_NAME, options={"HIDDEN"})
+    use_active_material: bpy.props.BoolProperty(
+        name="use active material",
+        default=True,
+        description="保存されているマテリアル番号の代わりにアクティブなマテリアルを使う",
+    )
+    chunk_points: bpy.props.IntProperty(
+        name="chunk points",
+        default=1000000,
+        min=1000,
+        description="一度に読み込んで書き込むポイント数",
+    )
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return (
+            obj is not None
+            and obj.type == "GPENCIL"
+            and obj.data.layers.active is not None
+        )
+
+    def execute(self, context):
+        obj: bpy.types.Object = context.active_object
+        try:
+            data = load_library(self.filepath)
+        except (OSError, ValueError, KeyError) as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
+        frame = get_or_create_frame(obj.data.layers.active, context.scene.frame_current)
+        material_index = obj.active_material_index if self.use_active_material else None
+        total = import_library(obj, frame, data, material_index, self.chunk_points)
+        self.report({"INFO"}, f"{total} points")
+        return {"FINISHED"}
+
+
+classses = [ScatterGpencilLibraryExport, ScatterGpencilLibraryImport]
+tools = []
+
+
+def register():
+    for c in classses:
+        bpy.utils.register_class(c)
+    for t in tools:
+        bpy.utils.register_tool(t)
+
+
+def unregister():
+    for c in classses:
+        bpy.utils.unregister_class(c)
+    for t in tools:
+        bpy.utils.unregister_tool(t)
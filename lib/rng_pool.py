@@ -0,0 +1,111 @@
+"""
+乱数をまとめて先に作っておき、モーダルのティックでは切り出すだけにする
+足りなくなる前にバックグラウンドのスレッドで次のブロックを作る(numpyの乱数生成中はGILが外れる)
+bpyに依存しないのでBlender外でも使える
+"""
+import queue
+import threading
+
+import numpy as np
+
+
+class RandomPool:
+    """
+    np.random.Generatorのnormal/uniform/random/integersと同じ呼び方ができる乱数の置き場
+    標準正規と[0, 1)一様のブロックをblock_sizeずつ作り、それぞれblocks個まで溜めておく
+    """
+
+    _kinds = ("normal", "uniform")
+
+    def __init__(self, block_size: int = 1 << 18, blocks: int = 2, seed=None):
+        self.block_size = block_size
+        worker_seed, fallback_seed = np.random.SeedSequence(seed).spawn(2)
+        # Generatorはスレッドセーフではないのでワーカーとメインで別々に持つ
+        self._worker_rng = np.random.default_rng(worker_seed)
+        self._fallback_rng = np.random.default_rng(fallback_seed)
+        self._queues = {kind: queue.Queue(maxsize=blocks) for kind in self._kinds}
+        self._current = {kind: np.empty(0) for kind in self._kinds}
+        self._position = {kind: 0 for kind in self._kinds}
+        # ワーカーが間に合わずにメインスレッドで作った回数
+        self.misses = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._fill, name="scatter-rng-pool", daemon=True
+        )
+        self._thread.start()
+
+    def _generate(self, kind: str, rng: np.random.Generator, size: int):
+        if kind == "normal":
+            return rng.standard_normal(size)
+        return rng.random(size)
+
+    def _fill(self):
+        while not self._stop.is_set():
+            filled = False
+            for kind, q in self._queues.items():
+                if not q.full():
+                    q.put(self._generate(kind, self._worker_rng, self.block_size))
+                    filled = True
+            if not filled:
+                self._wake.wait(0.5)
+                self._wake.clear()
+
+    def stop(self):
+        """ワーカースレッドを止める"""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=1.0)
+
+    def _take(self, kind: str, count: int) -> np.ndarray:
+        """kindの乱数をcount個切り出す 返すのはプールのビューなので書き換えないこと"""
+        current = self._current[kind]
+        position = self._position[kind]
+        if position + count <= len(current):
+            self._position[kind] = position + count
+            return current[position : position + count]
+        parts = [current[position:]]
+        remaining = count - len(parts[0])
+        while True:
+            try:
+                block = self._queues[kind].get_nowait()
+                self._wake.set()
+            except queue.Empty:
+                self.misses += 1
+                block = self._generate(
+                    kind, self._fallback_rng, max(remaining, self.block_size)
+                )
+            if remaining <= len(block):
+                break
+            parts.append(block)
+            remaining -= len(block)
+        parts.append(block[:remaining])
+        self._current[kind] = block
+        self._position[kind] = remaining
+        return np.concatenate(parts)
+
+    def _draw(self, kind: str, size):
+        if size is None:
+            return float(self._take(kind, 1)[0])
+        return self._take(kind, int(np.prod(size))).reshape(size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return loc + scale * self._draw("normal", size)
+
+    def standard_normal(self, size=None):
+        return self.normal(0.0, 1.0, size)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return low + (high - low) * self._draw("uniform", size)
+
+    def random(self, size=None):
+        return self.uniform(0.0, 1.0, size)
+
+    def integers(self, low, high=None, size=None):
+        if high is None:
+            low, high = 0, low
+        # 丸め誤差でhighちょうどになることがあるので詰めておく
+        values = np.minimum(np.floor(self.uniform(low, high, size)), high - 1)
+        if size is None:
+            return int(values)
+        return values.astype(np.int64)
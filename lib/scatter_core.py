@@ -0,0 +1,705 @@
+"""
+散布まわりの計算だけを集めたモジュール
+bpy/mathutilsに依存しないのでBlender外(素のCPython)でもimportして使える
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+
+try:
+    from .standalone import lazy_import
+except ImportError:
+    # パッケージを経由せずにトップレベルのモジュールとして読まれたとき
+    from standalone import lazy_import
+
+# アドオンの読み込みを軽くするためnumpyは最初に使うときに読み込む
+np = lazy_import("numpy")
+
+# (identifier, name, description) EnumPropertyのitemsにもそのまま使う
+DISTRIBUTIONS = (
+    ("GAUSS", "gauss", "正規分布 (標準偏差0.1)"),
+    ("CUBE", "cube", "一辺2の立方体内に一様"),
+    ("DISC", "disc", "XY平面上の半径1の円内に一様"),
+    ("SPHERE", "sphere", "半径1の球内に一様"),
+    ("RING", "ring", "XY平面上の半径ring_inner~1の円環内に一様"),
+)
+
+
+# seedを指定しないときに使い回す生成器 作るのが重いので呼び出しごとには作らない
+_shared_rng: np.random.Generator = None
+
+
+def get_rng(seed=None) -> np.random.Generator:
+    """
+    seedを渡すと再現性のある乱数生成器を返す
+    seedがNoneならモジュールで1つの生成器を返す
+    """
+    global _shared_rng
+    if seed is not None:
+        return np.random.default_rng(seed)
+    if _shared_rng is None:
+        _shared_rng = np.random.default_rng()
+    return _shared_rng
+
+
+def gauss_offsets(count: int, rng: np.random.Generator, sigma: float = 0.1):
+    return rng.normal(0, sigma, (count, 3))
+
+
+def cube_offsets(count: int, rng: np.random.Generator):
+    return rng.uniform(-1, 1, (count, 3))
+
+
+def disc_offsets(count: int, rng: np.random.Generator, inner: float = 0.0):
+    """円(inner>0なら円環)内に一様 z=0"""
+    theta = rng.uniform(0, 2 * np.pi, count)
+    # 面積に対して一様にするため半径は二乗の空間でサンプルする
+    r = np.sqrt(rng.uniform(inner * inner, 1, count))
+    offsets = np.zeros((count, 3))
+    offsets[:, 0] = r * np.cos(theta)
+    offsets[:, 1] = r * np.sin(theta)
+    return offsets
+
+
+def sphere_offsets(count: int, rng: np.random.Generator):
+    direction = rng.normal(0, 1, (count, 3))
+    length = np.linalg.norm(direction, axis=1, keepdims=True)
+    # 長さ0のベクトルが出たときのゼロ除算よけ
+    length[length == 0] = 1
+    r = np.cbrt(rng.uniform(0, 1, (count, 1)))
+    return direction / length * r
+
+
+def ring_offsets(count: int, rng: np.random.Generator, inner: float = 0.8):
+    return disc_offsets(count, rng, inner)
+
+
+_generators = {
+    "GAUSS": gauss_offsets,
+    "CUBE": cube_offsets,
+    "DISC": disc_offsets,
+    "SPHERE": sphere_offsets,
+    "RING": ring_offsets,
+}
+
+
+def generate_offsets(
+    distribution: str,
+    count: int,
+    scale: float = 1.0,
+    rng: np.random.Generator = None,
+    **kwargs,
+) -> np.ndarray:
+    """
+    distributionに従ったオフセットを(count, 3)のndarrayでまとめて返す
+    kwargsは各分布の関数にそのまま渡す(ring_offsetsのinnerなど)
+    """
+    if distribution not in _generators:
+        raise ValueError(f"unknown distribution: {distribution}")
+    if rng is None:
+        rng = get_rng()
+    offsets = _generators[distribution](count, rng, **kwargs)
+    if scale != 1.0:
+        offsets *= scale
+    return offsets
+
+
+def transform_points(matrix: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """4x4行列で(N, 3)の座標をまとめて変換する"""
+    matrix = np.asarray(matrix)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def resample_polyline(
+    points: np.ndarray, pressures: np.ndarray, spacing: float, carry: float = 0.0
+):
+    """
+    折れ線上にspacing間隔で等間隔にサンプルを置く
+    carryは前回の最後のサンプルから折れ線の始点までにすでに進んだ距離
+    (位置(M, 3), 筆圧(M,), 次回に渡すcarry)を返す
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    pressures = np.asarray(pressures, dtype=np.float64).reshape(-1)
+    empty = (np.empty((0, 3)), np.empty(0))
+    if len(points) == 0 or spacing <= 0:
+        return empty + (carry,)
+    segment = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    # 長さ0の区間があるとnp.interpの横軸が単調増加にならないので捨てる
+    keep = np.concatenate(([True], segment > 0))
+    points = points[keep]
+    pressures = pressures[keep]
+    distance = np.concatenate(([0.0], np.cumsum(segment[segment > 0])))
+    total = distance[-1]
+    first = max(spacing - carry, 0.0)
+    if first > total:
+        return empty + (carry + total,)
+    count = int(np.floor((total - first) / spacing)) + 1
+    s = first + np.arange(count) * spacing
+    positions = np.empty((count, 3))
+    for axis in range(3):
+        positions[:, axis] = np.interp(s, distance, points[:, axis])
+    sampled_pressures = np.interp(s, distance, pressures)
+    return positions, sampled_pressures, total - s[-1]
+
+
+def region_to_ndc(coords: np.ndarray, width: int, height: int) -> np.ndarray:
+    """リージョン座標(N, 2)を正規化デバイス座標(-1~1)に変換する"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return coords * (2.0 / np.array([width, height])) - 1.0
+
+
+def view_rays(ndc: np.ndarray, perspective_matrix_inv: np.ndarray):
+    """
+    正規化デバイス座標(N, 2)からニアクリップ上の始点とファークリップへの向きを返す
+    向きは正規化しない
+    """
+    ndc = np.asarray(ndc, dtype=np.float64).reshape(-1, 2)
+    count = len(ndc)
+    # ニアクリップ(z=-1)とファークリップ(z=1)の2点を逆投影してレイにする
+    clip = np.ones((count * 2, 4))
+    clip[:count, :2] = ndc
+    clip[count:, :2] = ndc
+    clip[:count, 2] = -1
+    world = clip @ np.asarray(perspective_matrix_inv).T
+    world = world[:, :3] / world[:, 3:]
+    origin = world[:count]
+    return origin, world[count:] - origin
+
+
+def unproject_to_plane(
+    ndc: np.ndarray,
+    perspective_matrix_inv: np.ndarray,
+    plane_co: np.ndarray,
+    plane_no: np.ndarray,
+) -> np.ndarray:
+    """
+    正規化デバイス座標(N, 2)をまとめて3D空間の平面上に逆投影する
+    bpy_extras.view3d_utils.region_2d_to_location_3dを(N, 2)に広げたもの
+    """
+    origin, direction = view_rays(ndc, perspective_matrix_inv)
+    plane_no = np.asarray(plane_no, dtype=np.float64)
+    denom = direction @ plane_no
+    # 平面と平行なレイは交点がないので始点のままにしておく
+    denom[denom == 0] = np.inf
+    t = ((np.asarray(plane_co) - origin) @ plane_no) / denom
+    return origin + direction * t[:, None]
+
+
+def project_to_region(
+    points: np.ndarray, perspective_matrix: np.ndarray, width: int, height: int
+):
+    """
+    3D座標(N, 3)をまとめてリージョン座標(N, 2)に投影する
+    視点の後ろにある点はFalseになるマスクも返す
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    clip = points @ np.asarray(perspective_matrix)[:, :3].T
+    clip += np.asarray(perspective_matrix)[:, 3]
+    w = clip[:, 3]
+    visible = w > 0
+    w = np.where(visible, w, 1.0)
+    ndc = clip[:, :2] / w[:, None]
+    coords = (ndc + 1.0) * (0.5 * np.array([width, height]))
+    return coords, visible
+
+
+def ray_box_mask(
+    origins: np.ndarray, directions: np.ndarray, box_min, box_max
+) -> np.ndarray:
+    """
+    レイ(N, 3)が軸平行な箱に当たるかのマスクを返す(スラブ法)
+    始点より後ろでしか当たらないレイはFalse
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inv = 1.0 / directions
+        t0 = (np.asarray(box_min) - origins) * inv
+        t1 = (np.asarray(box_max) - origins) * inv
+        # 軸に平行なレイで始点がちょうど面の上にあると0*infでnanになるのでその軸は無視する
+        near = np.nanmax(np.minimum(t0, t1), axis=1)
+        far = np.nanmin(np.maximum(t0, t1), axis=1)
+    return (near <= far) & (far >= 0)
+
+
+class SpatialHash:
+    """
+    最小距離で間引くための一様グリッド
+    セルの一辺をmin_distanceにしているので近傍27セルだけ調べればよい
+    セルは配列で持った開番地法のハッシュ表で引くので、まとめて渡した点を一度に調べられる
+    """
+
+    _neighbours = [
+        (x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)
+    ]
+    # セル座標は軸ごとに下位21bitだけ使って1つのint64にまとめる
+    # 2**21セル離れたセルは同じセルとして扱うが、距離は実際の座標で比べるので間引きは正しいまま
+    _key_bits = 21
+    # _neighboursの中で自分のセル(0, 0, 0)の位置
+    _center = 13
+
+    def __init__(self, min_distance: float, max_per_cell: int = 0):
+        if min_distance <= 0:
+            raise ValueError("min_distance must be positive")
+        self.min_distance = min_distance
+        self.max_per_cell = max_per_cell
+        # ハッシュ表 スロットごとの(セルのキー, セル番号) 空きはセル番号が-1
+        self._table = self._empty_table(64)
+        # セル番号ごとの点(空きはinf)と点の数 1セルの点の数が増えたら列を広げる
+        self._points = np.full((16, 2, 3), np.inf)
+        self._counts = np.zeros(16, dtype=np.int64)
+        self._cells = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def insert(self, points: np.ndarray) -> np.ndarray:
+        """
+        既存の点(と同じ呼び出しで先に採用した点)からmin_distance以上離れた点だけ登録する
+        採用した点がTrueのマスクを返す
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        accepted = np.zeros(len(points), dtype=bool)
+        if len(points) == 0:
+            return accepted
+        cells = np.floor(points / self.min_distance).astype(np.int64)
+        # (N, 27) 近傍セルのキー 真ん中(13番目)が自分のセル
+        neighbours = self._neighbour_keys(cells)
+        rows = self._lookup(neighbours.reshape(-1)).reshape(neighbours.shape)
+        own = rows[:, self._center]
+        counts = np.where(own >= 0, self._counts[own], 0)
+        free = ~self._near_stored(points, rows)
+        if self.max_per_cell:
+            free &= counts < self.max_per_cell
+        candidates = np.flatnonzero(free)
+        accepted[candidates] = self._resolve(
+            points[candidates], neighbours[candidates], counts[candidates]
+        )
+        self._store(points[accepted], neighbours[accepted, self._center])
+        self._count += int(accepted.sum())
+        return accepted
+
+    def _neighbour_keys(self, cells: np.ndarray) -> np.ndarray:
+        """セル座標(N, 3)から近傍27セルのキー(N, 27)を_neighboursの順に作る"""
+        bits = self._key_bits
+        mask = (1 << bits) - 1
+        steps = np.arange(-1, 2)
+        x = ((cells[:, 0, None] + steps) & mask) << (2 * bits)
+        y = ((cells[:, 1, None] + steps) & mask) << bits
+        z = (cells[:, 2, None] + steps) & mask
+        keys = x[:, :, None, None] | y[:, None, :, None] | z[:, None, None, :]
+        return keys.reshape(len(cells), -1)
+
+    @staticmethod
+    def _empty_table(size: int) -> np.ndarray:
+        table = np.zeros((size, 2), dtype=np.int64)
+        table[:, 1] = -1
+        return table
+
+    def _hash(self, keys: np.ndarray) -> np.ndarray:
+        # 近いセルのキーが近い値になるのでかけ算で上位bitに散らしてから使う
+        shift = np.uint64(64 - (len(self._table).bit_length() - 1))
+        mixed = keys.view(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        return (mixed >> shift).astype(np.int64)
+
+    def _lookup(self, keys: np.ndarray) -> np.ndarray:
+        """キー(N,)のセル番号を返す 登録されていないセルは-1"""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if not self._cells:
+            return rows
+        mask = len(self._table) - 1
+        pending = np.arange(len(keys))
+        slots = self._hash(keys)
+        while len(pending):
+            # キーとセル番号を並べて持っているので1回のtakeで両方引ける
+            entries = self._table.take(slots, axis=0)
+            found = entries[:, 1]
+            match = (found >= 0) & (entries[:, 0] == keys.take(pending))
+            rows[pending[match]] = found[match]
+            probe = (found >= 0) & ~match
+            pending = pending[probe]
+            slots = (slots[probe] + 1) & mask
+        return rows
+
+    def _assign(self, keys: np.ndarray, rows: np.ndarray):
+        """まだ表にないキーをセル番号rowsとして空きスロットに入れる"""
+        table = self._table
+        mask = len(table) - 1
+        pending = np.arange(len(keys))
+        slots = self._hash(keys)
+        while len(pending):
+            empty = table[slots, 1] < 0
+            # 同じ空きスロットに複数入ろうとしたら書き込めた1つだけが入る
+            table[slots[empty], 1] = rows[pending[empty]]
+            won = empty & (table[slots, 1] == rows[pending])
+            table[slots[won], 0] = keys[pending[won]]
+            pending = pending[~won]
+            slots = (slots[~won] + 1) & mask
+
+    def _add_cells(self, keys: np.ndarray) -> np.ndarray:
+        start, end = self._cells, self._cells + len(keys)
+        capacity = len(self._counts)
+        if end > capacity:
+            capacity = max(end, capacity * 2)
+            for name, fill in (("_points", np.inf), ("_counts", 0)):
+                old = getattr(self, name)
+                new = np.full((capacity,) + old.shape[1:], fill, dtype=old.dtype)
+                new[:start] = old[:start]
+                setattr(self, name, new)
+        self._cells = end
+        rows = np.arange(start, end)
+        if end * 4 > len(self._table):
+            # 埋まりすぎると探索が長くなるので1/4を超えたら広げて入れ直す
+            used = self._table[self._table[:, 1] >= 0]
+            size = len(self._table)
+            while end * 4 > size:
+                size *= 2
+            self._table = self._empty_table(size)
+            self._assign(used[:, 0], used[:, 1])
+        self._assign(keys, rows)
+        return rows
+
+    def _near_stored(self, points: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """近傍セルのセル番号rows(N, 27)の点のどれかからmin_distance未満の点がTrue"""
+        hit = np.flatnonzero(rows >= 0)
+        index = hit // rows.shape[1]
+        # 点が多いのでファンシーインデックスより速いtakeで集める
+        stored = self._points.take(rows.take(hit), axis=0)
+        offset = stored - points.take(index, axis=0)[:, None, :]
+        distance = np.einsum("ijk,ijk->ij", offset, offset)
+        near = np.zeros(len(points), dtype=bool)
+        near[index[(distance < self.min_distance**2).any(axis=1)]] = True
+        return near
+
+    def _resolve(
+        self, points: np.ndarray, neighbours: np.ndarray, counts: np.ndarray
+    ) -> np.ndarray:
+        """
+        同じ呼び出しの点どうしの衝突を、先の点から順に採用したのと同じ結果になるように決める
+        近傍セルにいる先の点がすべて決まった点から何回かに分けてまとめて決める
+        """
+        size = len(points)
+        own = neighbours[:, self._center]
+        order = np.argsort(own, kind="stable")
+        keys, starts, sizes = np.unique(
+            own[order], return_index=True, return_counts=True
+        )
+        # 近傍セルごとにそのセルに入っている候補を展開して(後の点, 先の点)の組を作る
+        index = np.minimum(np.searchsorted(keys, neighbours.reshape(-1)), len(keys) - 1)
+        found = keys[index] == neighbours.reshape(-1)
+        low = starts[index]
+        number = np.where(found, sizes[index], 0)
+        total = int(number.sum())
+        later = np.repeat(np.arange(size).repeat(len(self._neighbours)), number)
+        rank = np.arange(total) - np.repeat(np.cumsum(number) - number, number)
+        earlier = order[np.repeat(low, number) + rank]
+        pairs = earlier < later
+        later, earlier = later[pairs], earlier[pairs]
+        distance = ((points[later] - points[earlier]) ** 2).sum(axis=1)
+        close = distance < self.min_distance**2
+        max_per_cell = self.max_per_cell
+        if max_per_cell:
+            same = own[later] == own[earlier]
+            keep = close | same
+            later, earlier, close, same = (
+                later[keep],
+                earlier[keep],
+                close[keep],
+                same[keep],
+            )
+        # 0: 未定 1: 採用 2: 不採用
+        state = np.zeros(size, dtype=np.int8)
+        while True:
+            undecided = state == 0
+            if not undecided.any():
+                break
+            partner = state[earlier]
+            rejected = np.zeros(size, dtype=bool)
+            rejected[later[close & (partner == 1)]] = True
+            waiting = np.zeros(size, dtype=bool)
+            if max_per_cell:
+                filled = np.bincount(later[same & (partner == 1)], minlength=size)
+                rejected |= counts + filled >= max_per_cell
+                waiting[later[partner == 0]] = True
+            else:
+                waiting[later[close & (partner == 0)]] = True
+            state[undecided & rejected] = 2
+            state[undecided & ~rejected & ~waiting] = 1
+        return state == 1
+
+    def _store(self, points: np.ndarray, keys: np.ndarray):
+        if len(points) == 0:
+            return
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        rows = self._lookup(unique)
+        new = rows < 0
+        if new.any():
+            # 新しいセルは入力順に番号を振る
+            order = np.argsort(first[new], kind="stable")
+            added = np.empty(new.sum(), dtype=np.int64)
+            added[order] = self._add_cells(unique[new][order])
+            rows[new] = added
+        rows = rows[inverse.reshape(-1)]
+        # 同じセルに入る点には登録済みの点の後ろから順に場所を割り当てる
+        order = np.argsort(rows, kind="stable")
+        sorted_rows = rows[order]
+        start = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]])
+        rank = np.arange(len(rows)) - np.repeat(start, np.diff(np.r_[start, len(rows)]))
+        slots = np.empty_like(rows)
+        slots[order] = self._counts[sorted_rows] + rank
+        width = self._points.shape[1]
+        if slots.max() >= width:
+            # 一辺min_distanceのセルに入る点の数は限られるので列はたまにしか広げない
+            width = max(slots.max() + 1, width * 2)
+            self._points = np.pad(
+                self._points,
+                ((0, 0), (0, width - self._points.shape[1]), (0, 0)),
+                constant_values=np.inf,
+            )
+        self._points[rows, slots] = points
+        self._counts += np.bincount(rows, minlength=len(self._counts))
+
+
+class StagingBuffer:
+    """
+    ストロークに書き込む前のポイントを溜めておく
+    容量が足りなくなったら倍にして確保し直すので追加はだいたい定数時間
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._size = 0
+        self._co = np.empty((capacity, 3), dtype=np.float32)
+        self._pressure = np.empty(capacity, dtype=np.float32)
+        self._strength = np.empty(capacity, dtype=np.float32)
+        self._vertex_color = np.empty((capacity, 4), dtype=np.float32)
+        # 1回でも色つきで追加されたらTrue 色なしの分は0で埋めておく
+        self.use_color = False
+        # 追加/クリアのたびに増える プレビューの作り直しの判定に使う
+        self.version = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._pressure)
+
+    def _reserve(self, size: int):
+        if size <= self.capacity:
+            return
+        capacity = max(size, self.capacity * 2)
+        for name in ("_co", "_pressure", "_strength", "_vertex_color"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: self._size] = old[: self._size]
+            setattr(self, name, new)
+
+    def append(
+        self,
+        co: np.ndarray,
+        pressure: np.ndarray,
+        strength: np.ndarray,
+        vertex_color: np.ndarray = None,
+    ):
+        count = len(co)
+        if count == 0:
+            return
+        self._reserve(self._size + count)
+        start, end = self._size, self._size + count
+        self._co[start:end] = co
+        self._pressure[start:end] = pressure
+        self._strength[start:end] = strength
+        if vertex_color is None:
+            self._vertex_color[start:end] = 0
+        else:
+            self._vertex_color[start:end] = vertex_color
+            self.use_color = True
+        self._size = end
+        self.version += 1
+
+    def clear(self):
+        """中身だけ捨てる 確保した容量はそのまま使い回す"""
+        self._size = 0
+        self.use_color = False
+        self.version += 1
+
+    @property
+    def co(self) -> np.ndarray:
+        return self._co[: self._size]
+
+    @property
+    def pressure(self) -> np.ndarray:
+        return self._pressure[: self._size]
+
+    @property
+    def strength(self) -> np.ndarray:
+        return self._strength[: self._size]
+
+    @property
+    def vertex_color(self) -> np.ndarray:
+        return self._vertex_color[: self._size]
+
+
+def grid_cells(points: np.ndarray, cell_size: float, groups: np.ndarray = None):
+    """
+    点をcell_size四方のセルに分ける groupsを渡すとグループ(ストローク番号など)ごとに別のセルにする
+    (セルごとに最初の点のインデックス, 各点のセル番号)を返す
+    """
+    if cell_size <= 0:
+        raise ValueError("cell_size must be positive")
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    keys = np.floor(points / cell_size).astype(np.int64)
+    if groups is not None:
+        keys = np.column_stack((np.asarray(groups, dtype=np.int64), keys))
+    keys -= keys.min(axis=0)
+    span = keys.max(axis=0) + 1
+    if np.prod(span.astype(np.float64)) < 2**62:
+        # セル座標を1つのint64にまとめると1次元のuniqueで済むので速い
+        flat = keys[:, 0]
+        for axis in range(1, keys.shape[1]):
+            flat = flat * span[axis] + keys[:, axis]
+        _, first, inverse = np.unique(flat, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(
+            keys, axis=0, return_index=True, return_inverse=True
+        )
+    return first, inverse.reshape(-1)
+
+
+def cell_means(values: np.ndarray, inverse: np.ndarray, cells: int) -> np.ndarray:
+    """grid_cellsのセル番号ごとにvalues(N,)か(N, K)の平均を取る"""
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.bincount(inverse, minlength=cells)
+    if values.ndim == 1:
+        return np.bincount(inverse, weights=values, minlength=cells) / counts
+    return np.stack(
+        [
+            np.bincount(inverse, weights=values[:, k], minlength=cells) / counts
+            for k in range(values.shape[1])
+        ],
+        axis=1,
+    )
+
+
+class StampBank:
+    """
+    スタンプ(点のかたまり)をいくつか持っておいて、まとめて回転/拡大して配置する
+    長さの違うスタンプも扱えるように全部の点をつなげてoffsetsで区切っている
+    """
+
+    def __init__(self, clusters: list):
+        clusters = [np.asarray(c, dtype=np.float64).reshape(-1, 3) for c in clusters]
+        clusters = [c for c in clusters if len(c)]
+        if not clusters:
+            raise ValueError("no stamp clusters")
+        counts = [len(c) for c in clusters]
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        # 各スタンプの重心が原点に来るようにしておく
+        self.points = np.concatenate([c - c.mean(axis=0) for c in clusters])
+        self.points.flags.writeable = False
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def place(
+        self, indices: np.ndarray, centers: np.ndarray, matrices: np.ndarray
+    ) -> tuple:
+        """
+        indices番目のスタンプを(N, 3, 3)のmatricesで変換してcentersに置く
+        (配置した点(M, 3), 各点がどのcentersのものか(M,))を返す
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = self.offsets[indices + 1] - self.offsets[indices]
+        owner = np.repeat(np.arange(len(indices)), counts)
+        # スタンプ内での番号 + スタンプの先頭の位置 で点を集める
+        first = np.zeros(len(indices), dtype=np.int64)
+        np.cumsum(counts[:-1], out=first[1:])
+        source = np.arange(len(owner)) - first[owner] + self.offsets[indices][owner]
+        placed = np.einsum("nij,nj->ni", matrices[owner], self.points[source])
+        return placed + centers[owner], owner
+
+
+@lru_cache(maxsize=16)
+def procedural_stamp_bank(distribution: str, points: int, variants: int) -> StampBank:
+    """distributionで作った半径1のスタンプをvariants個持つStampBank 同じ引数なら使い回す"""
+    rng = get_rng(0)
+    return StampBank(
+        [generate_offsets(distribution, points, 1.0, rng) for _ in range(variants)]
+    )
+
+
+def stamp_matrices(
+    count: int,
+    rng: np.random.Generator,
+    scale: float = 1.0,
+    scale_jitter: float = 0.0,
+    axis: np.ndarray = None,
+) -> np.ndarray:
+    """
+    スタンプを置くときの(count, 3, 3)の行列 axisがあればその軸まわりにランダムに回す
+    拡大率はscale * (1 ± scale_jitter)の一様
+    """
+    scales = scale * (1 + scale_jitter * rng.uniform(-1, 1, count))
+    if axis is None:
+        matrices = np.broadcast_to(np.eye(3), (count, 3, 3)).copy()
+    else:
+        # ロドリゲスの回転公式をまとめて計算する
+        k = np.asarray(axis, dtype=np.float64)
+        k = k / np.linalg.norm(k)
+        cross = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+        theta = rng.uniform(0, 2 * np.pi, count)[:, None, None]
+        matrices = (
+            np.eye(3)
+            + np.sin(theta) * cross
+            + (1 - np.cos(theta)) * (cross @ cross)
+        )
+    return matrices * scales[:, None, None]
+
+
+def scatter_along_guides(
+    guides: list,
+    spacing: float,
+    count: int,
+    scale: float,
+    distribution: str = "GAUSS",
+    rng: np.random.Generator = None,
+):
+    """
+    ガイドの折れ線(M, 3)のリストに沿ってspacing間隔にcount個ずつ散布した点を作る
+    ガイドごとに(位置(N, 3), 筆圧(N,))のリストを返す 筆圧はすべて1
+    """
+    if rng is None:
+        rng = get_rng()
+    results = []
+    for guide in guides:
+        guide = np.asarray(guide, dtype=np.float64).reshape(-1, 3)
+        centers, _, _ = resample_polyline(
+            guide, np.ones(len(guide)), spacing, spacing
+        )
+        centers = np.repeat(centers, count, axis=0)
+        offsets = generate_offsets(distribution, len(centers), scale, rng)
+        results.append((centers + offsets, np.ones(len(centers))))
+    return results
+
+
+def scatter_frame_job(
+    frame_number: int,
+    guides: list,
+    spacing: float,
+    count: int,
+    scale: float,
+    distribution: str = "GAUSS",
+    seed: int = None,
+):
+    """
+    1フレーム分のscatter_along_guides プロセスプールのワーカーから呼ぶ用
+    (frame_number, 結果)を返す
+    """
+    rng = get_rng(seed)
+    return frame_number, scatter_along_guides(
+        guides, spacing, count, scale, distribution, rng
+    )
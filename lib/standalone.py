@@ -0,0 +1,43 @@
+"""
+bpyに依存しないモジュールを読み込むためのヘルパー
+これ自体もbpyに依存しないのでBlender外(素のCPython)やワーカープロセスでも使える
+"""
+import importlib.util
+import os
+import sys
+
+lib_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def lazy_import(name: str):
+    """
+    属性に最初にアクセスしたときに読み込まれるモジュールを返す
+    numpyやbglのように重いモジュールをアドオンの読み込み時に読まないようにする
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(name: str):
+    """
+    lib内のモジュールをアドオンのパッケージ(bpyをimportする)を経由せずに
+    トップレベルのnameとして読み込んで返す
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    # 読み込むモジュールが"from standalone import ..."でこのモジュールを引けるようにする
+    sys.modules.setdefault("standalone", sys.modules[__name__])
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(lib_dir, name + ".py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,153 @@
+"""
+メッシュに散布するためのBVHTreeのキャッシュ
+オブジェクトごとに1回だけ作ってジオメトリが更新されるまで使い回す
+"""
+from __future__ import annotations
+
+import bpy
+from bpy.app.handlers import persistent
+from logging import getLogger
+from . import scatter_core
+from .standalone import lazy_import
+from mathutils.bvhtree import BVHTree
+
+logger = getLogger(__name__)
+
+np = lazy_import("numpy")
+
+# (identifier, name, description) EnumPropertyのitemsにもそのまま使う
+SURFACE_TARGETS = (
+    ("SELECTED", "selected", "選択中のメッシュ"),
+    ("COLLECTION", "collection", "surface_collectionのコレクションのメッシュ"),
+    (
+        "VISIBLE",
+        "visible",
+        "表示されているすべてのメッシュ 重いシーンでは最初のBVHTreeの作成に時間がかかる",
+    ),
+)
+
+# オブジェクト名 -> BVHTree(オブジェクトのローカル座標)
+_trees = {}
+# ジオメトリが更新されて作り直しが必要なオブジェクト名
+_dirty = set()
+
+
+def get_tree(obj: bpy.types.Object, depsgraph: bpy.types.Depsgraph) -> BVHTree:
+    """キャッシュがあればそれを、なければ評価済みメッシュからBVHTreeを作って返す"""
+    name = obj.name_full
+    tree = _trees.get(name)
+    if tree is None or name in _dirty:
+        tree = BVHTree.FromObject(obj, depsgraph)
+        _trees[name] = tree
+        _dirty.discard(name)
+        logger.debug("build bvhtree: %s", name)
+    return tree
+
+
+def clear():
+    _trees.clear()
+    _dirty.clear()
+
+
+def target_objects(context, target: str, collection: str = "") -> list:
+    """surface_targetに従って投影先にする表示中のメッシュのリストを返す"""
+    if target == "SELECTED":
+        objects = context.selected_objects
+    elif target == "COLLECTION":
+        coll = bpy.data.collections.get(collection)
+        objects = coll.all_objects if coll is not None else []
+    else:
+        objects = context.visible_objects
+    return [o for o in objects if o.type == "MESH" and o.visible_get()]
+
+
+def ray_cast_batch(
+    objects: list,
+    depsgraph: bpy.types.Depsgraph,
+    origins: np.ndarray,
+    directions: np.ndarray,
+):
+    """
+    ワールド座標のレイ(N, 3)をまとめて複数のメッシュに飛ばして一番近い交点を求める
+    (交点(N, 3), 法線(N, 3), 当たったかのマスク(N,))を返す
+    BVHTree.ray_castは1本ずつしか飛ばせないので座標変換とバウンディングボックスでの
+    絞り込みだけまとめてやる 箱に当たらないオブジェクトはBVHTreeも作らない
+    """
+    count = len(origins)
+    locations = np.zeros((count, 3))
+    normals = np.zeros((count, 3))
+    best = np.full(count, np.inf)
+    for obj in objects:
+        matrix = np.array(obj.matrix_world)
+        matrix_inv = np.linalg.inv(matrix)
+        local_origins = origins @ matrix_inv[:3, :3].T + matrix_inv[:3, 3]
+        local_directions = directions @ matrix_inv[:3, :3].T
+        # ローカル座標の箱なのでワールドで見ると回転した箱で絞り込むことになる
+        bound_box = np.array(obj.bound_box)
+        candidates = np.flatnonzero(
+            scatter_core.ray_box_mask(
+                local_origins, local_directions, bound_box.min(0), bound_box.max(0)
+            )
+        )
+        if len(candidates) == 0:
+            continue
+        tree = get_tree(obj, depsgraph)
+        hit_index = []
+        hit_locations = []
+        hit_normals = []
+        for i, o, d in zip(
+            candidates.tolist(),
+            local_origins[candidates].tolist(),
+            local_directions[candidates].tolist(),
+        ):
+            location, normal, _, _ = tree.ray_cast(o, d)
+            if location is None:
+                continue
+            hit_index.append(i)
+            hit_locations.append(location)
+            hit_normals.append(normal)
+        if not hit_index:
+            continue
+        hit_index = np.array(hit_index)
+        world_locations = np.array(hit_locations) @ matrix[:3, :3].T + matrix[:3, 3]
+        # 法線は逆行列の転置で変換する
+        world_normals = np.array(hit_normals) @ matrix_inv[:3, :3]
+        length = np.linalg.norm(world_normals, axis=1, keepdims=True)
+        length[length == 0] = 1
+        world_normals /= length
+        distance = np.linalg.norm(world_locations - origins[hit_index], axis=1)
+        closer = distance < best[hit_index]
+        index = hit_index[closer]
+        best[index] = distance[closer]
+        locations[index] = world_locations[closer]
+        normals[index] = world_normals[closer]
+    return locations, normals, np.isfinite(best)
+
+
+@persistent
+def mark_dirty(scene, depsgraph):
+    """ジオメトリが更新されたオブジェクトのBVHTreeを作り直すようにする"""
+    if not _trees:
+        return
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+        id_data = update.id.original
+        if isinstance(id_data, bpy.types.Object):
+            if id_data.name_full in _trees:
+                _dirty.add(id_data.name_full)
+        elif isinstance(id_data, bpy.types.Mesh):
+            for name in _trees:
+                obj = bpy.data.objects.get(name)
+                if obj is None or obj.data == id_data:
+                    _dirty.add(name)
+
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(mark_dirty)
+
+
+def unregister():
+    if mark_dirty in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(mark_dirty)
+    clear()
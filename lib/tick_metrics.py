@@ -0,0 +1,79 @@
+"""
+モーダルの1ティックごとの計測値を固定長のリングバッファに溜める
+bpyに依存しないのでBlender外でも使える
+"""
+import json
+
+import numpy as np
+
+# 時間は秒 pointsは書き込んだポイント数 intervalは前のティックからの間隔
+# countはそのティックで置こうとした数 timerはその時のタイマー間隔(スケジューラで変わる)
+# commitはdeferredで溜めた分を書き込んだ時間 totalには含めない
+FIELDS = (
+    "total",
+    "location",
+    "generate",
+    "write",
+    "commit",
+    "points",
+    "interval",
+    "count",
+    "timer",
+)
+
+
+class TickMetrics:
+    """1ティック分をrecordで書き込み、summaryでp50/p95/maxを出す"""
+
+    def __init__(self, capacity: int = 512, requested_rate: float = 0.0):
+        self.capacity = capacity
+        self.requested_rate = requested_rate
+        self._data = np.zeros((capacity, len(FIELDS)))
+        self._index = 0
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def record(self, values: tuple):
+        """FIELDSと同じ並びのタプルを1行書き込む 一番古い行を上書きする"""
+        self._data[self._index] = values
+        self._index = (self._index + 1) % self.capacity
+        self._count += 1
+
+    @property
+    def total_ticks(self) -> int:
+        return self._count
+
+    def rows(self) -> np.ndarray:
+        """溜まっている行を古い順に返す"""
+        if self._count < self.capacity:
+            return self._data[: self._count]
+        return np.roll(self._data, -self._index, axis=0)
+
+    def summary(self) -> dict:
+        """{field: {"p50", "p95", "max"}}と実際のティックレートを返す"""
+        rows = self.rows()
+        result = {"ticks": self._count, "requested_rate": self.requested_rate}
+        if len(rows) == 0:
+            return result
+        p50, p95 = np.percentile(rows, [50, 95], axis=0)
+        peak = rows.max(axis=0)
+        for i, field in enumerate(FIELDS):
+            result[field] = {"p50": p50[i], "p95": p95[i], "max": peak[i]}
+        # 最初のティックは間隔が0なので除く
+        intervals = rows[:, FIELDS.index("interval")]
+        intervals = intervals[intervals > 0]
+        result["actual_rate"] = 1 / np.median(intervals) if len(intervals) else 0.0
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "fields": FIELDS,
+            "summary": self.summary(),
+            "rows": self.rows().tolist(),
+        }
+
+    def dump(self, filepath: str):
+        with open(filepath, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=float)
@@ -0,0 +1,64 @@
+"""
+1ティックの時間が予算に収まるように、1ティックのポイント数とタイマー間隔を決める
+bpyに依存しないのでBlender外でも使える
+"""
+
+
+class TickScheduler:
+    """
+    updateで実際にかかった時間とポイント数を渡すと、1ポイントあたりのコストを推定して
+    points_per_secondを出しつつbudget秒を超えないcountとintervalを決め直す
+    予算に余裕があればintervalはbase_intervalのまま、足りなければティックを細かくする
+    """
+
+    def __init__(
+        self,
+        budget: float,
+        points_per_second: float,
+        base_interval: float,
+        min_interval: float = 1 / 240,
+        smoothing: float = 0.2,
+    ):
+        self.budget = budget
+        self.points_per_second = points_per_second
+        self.base_interval = base_interval
+        self.min_interval = min(min_interval, base_interval)
+        self.smoothing = smoothing
+        # 1ポイントあたりの秒 最初のティックを測るまでは分からない
+        self.cost_per_point = 0.0
+        self.interval = base_interval
+        self.count = max(1, round(points_per_second * base_interval))
+
+    @property
+    def achieved_points_per_second(self) -> float:
+        """今のcountとintervalで出せる密度 予算が足りないとpoints_per_secondより小さくなる"""
+        return self.count / self.interval
+
+    def update(self, elapsed: float, points: int):
+        """
+        1ティック分の計測値を反映してcountとintervalを決め直す
+        pointsはcountに対応する作った数 間引いた後の書き込んだ数を渡すとコストが膨らむ
+        """
+        if points <= 0:
+            return
+        cost = elapsed / points
+        if self.cost_per_point == 0.0:
+            self.cost_per_point = cost
+        else:
+            # ティックごとのばらつきで振れないように指数移動平均にする
+            self.cost_per_point += self.smoothing * (cost - self.cost_per_point)
+        wanted = self.points_per_second * self.base_interval
+        affordable = self.budget / self.cost_per_point
+        if wanted <= affordable:
+            interval = self.base_interval
+            count = wanted
+        else:
+            # 予算内で置ける分だけにして、そのぶんタイマーを速くして密度を保つ
+            count = affordable
+            interval = max(count / self.points_per_second, self.min_interval)
+        self.count = max(1, int(round(count)))
+        self.interval = interval
+
+    def should_reset_timer(self, current_interval: float, tolerance: float = 0.2):
+        """タイマーを作り直すほどintervalが変わったか 毎ティック作り直さないように幅を持たせる"""
+        return abs(self.interval - current_interval) > current_interval * tolerance
@@ -38,6 +38,14 @@ def calc_vector_length(a: mathutils.Vector, b: mathutils.Vector) -> float:
     return vec.length
 
 
+def get_or_create_frame(layer: bpy.types.GPencilLayer, frame_number: int):
+    """指定フレームのキーフレームがなければ作って返す"""
+    for frame in layer.frames:
+        if frame.frame_number == frame_number:
+            return frame
+    return layer.frames.new(frame_number)
+
+
 def gp_licker(gp_data: bpy.types.GreasePencil, func, state={}):
 
     if type(gp_data) is not bpy.types.GreasePencil:
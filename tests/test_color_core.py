@@ -0,0 +1,110 @@
+"""
+color_coreの単体テスト Blenderなしで動く
+python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "lib"))
+import standalone  # noqa: E402
+
+color = standalone.load("color_core")
+
+
+class TestReduceColors(unittest.TestCase):
+    def test_mean_and_median(self):
+        pixels = np.array([(0, 0, 0, 1), (0, 0, 0, 1), (1, 1, 1, 1)], dtype=np.float32)
+        np.testing.assert_allclose(
+            color.reduce_colors(pixels, "MEAN"), (1 / 3, 1 / 3, 1 / 3, 1)
+        )
+        np.testing.assert_allclose(color.reduce_colors(pixels, "MEDIAN"), (0, 0, 0, 1))
+        # フラットな配列も(N, 4)として扱う
+        np.testing.assert_allclose(
+            color.reduce_colors(pixels.ravel()), color.reduce_colors(pixels)
+        )
+
+    def test_weighted_prefers_center(self):
+        pixels = np.zeros((5, 5, 4))
+        pixels[2, 2] = 1
+        weighted = color.reduce_colors(pixels, "WEIGHTED")
+        self.assertGreater(weighted[0], color.reduce_colors(pixels, "MEAN")[0])
+        self.assertAlmostEqual(color.gaussian_weights(5, 5).sum(), 1.0)
+
+
+class TestSrgb(unittest.TestCase):
+    def test_known_values(self):
+        np.testing.assert_allclose(
+            color.linear_to_srgb([0.0, 0.001, 0.5, 1.0]),
+            [0.0, 0.01292, 0.735357, 1.0],
+            atol=1e-6,
+        )
+
+    def test_round_trip(self):
+        values = np.linspace(0, 1, 101)
+        np.testing.assert_allclose(
+            color.srgb_to_linear(color.linear_to_srgb(values)), values, atol=1e-9
+        )
+
+    def test_clips_out_of_range(self):
+        np.testing.assert_allclose(color.srgb_to_linear([-1.0, 2.0]), [0.0, 1.0])
+
+
+class TestSampleImage(unittest.TestCase):
+    def test_nearest_and_clamp(self):
+        pixels = np.arange(2 * 3).reshape(2, 3, 1)
+        uv = [(0.0, 0.0), (0.99, 0.0), (0.5, 0.99), (-1, 2)]
+        self.assertEqual(color.sample_image(pixels, uv).ravel().tolist(), [0, 2, 4, 3])
+
+
+class TestKmeans(unittest.TestCase):
+    palette = np.array([(1, 0, 0), (0, 1, 0), (0, 0, 1)], dtype=np.float64)
+
+    def test_finds_clusters(self):
+        rng = np.random.default_rng(0)
+        labels = rng.integers(0, 3, 3000)
+        colors = self.palette[labels] + rng.normal(0, 0.02, (3000, 3))
+        centers, counts = color.kmeans(colors, 3, rng=np.random.default_rng(1))
+        self.assertEqual(counts.sum(), 3000)
+        # 中心を元のパレットの順に並べ替えて比べる
+        order = [np.argmin(np.linalg.norm(centers - p, axis=1)) for p in self.palette]
+        np.testing.assert_allclose(centers[order], self.palette, atol=0.01)
+        np.testing.assert_array_equal(counts[order], np.bincount(labels))
+
+    def test_counts_come_from_samples(self):
+        colors = np.repeat(self.palette, 1000, axis=0)
+        centers, counts = color.kmeans(colors, 3, max_samples=300)
+        self.assertEqual(counts.sum(), 300)
+        self.assertEqual(len(centers), 3)
+
+    def test_k_is_limited_by_unique_colors(self):
+        colors = np.array([(0.2, 0.2, 0.2, 1)] * 10)
+        centers, counts = color.kmeans(colors, 8)
+        np.testing.assert_allclose(centers, [(0.2, 0.2, 0.2)])
+        self.assertEqual(counts.tolist(), [10])
+
+
+class TestColorLUT(unittest.TestCase):
+    def test_lookup_matches_nearest(self):
+        palette = np.random.default_rng(0).uniform(0, 1, (6, 3))
+        lut = color.ColorLUT(palette, resolution=64)
+        colors = np.random.default_rng(1).uniform(0, 1, (500, 4))
+        distance = np.linalg.norm(colors[:, None, :3] - palette[None], axis=2)
+        nearest = distance.argmin(axis=1)
+        # 格子の中心で決めているので境界付近だけずれることがある
+        self.assertGreater((lut.lookup(colors) == nearest).mean(), 0.95)
+
+    def test_exact_palette_colors(self):
+        palette = [(0, 0, 0), (1, 1, 1), (1, 0, 0)]
+        lut = color.ColorLUT(palette)
+        self.assertEqual(lut.lookup(palette).tolist(), [0, 1, 2])
+
+    def test_empty_palette(self):
+        with self.assertRaises(ValueError):
+            color.ColorLUT(np.empty((0, 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+rng_poolの単体テスト Blenderなしで動く
+python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "lib"))
+import standalone  # noqa: E402
+
+rng_pool = standalone.load("rng_pool")
+
+
+class TestRandomPool(unittest.TestCase):
+    def setUp(self):
+        # ブロックを小さくしてブロックをまたぐ切り出しも通るようにする
+        self.pool = rng_pool.RandomPool(block_size=64, seed=0)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_shapes(self):
+        self.assertEqual(self.pool.normal(size=(10, 3)).shape, (10, 3))
+        self.assertEqual(self.pool.uniform(size=5).shape, (5,))
+        self.assertIsInstance(self.pool.random(), float)
+        self.assertIsInstance(self.pool.integers(3), int)
+
+    def test_ranges(self):
+        values = self.pool.uniform(-2, 3, size=1000)
+        self.assertTrue(np.all((values >= -2) & (values < 3)))
+        integers = self.pool.integers(1, 4, size=1000)
+        self.assertEqual(integers.dtype, np.int64)
+        self.assertEqual(sorted(set(integers.tolist())), [1, 2, 3])
+        self.assertTrue(np.all(self.pool.integers(5, size=100) < 5))
+
+    def test_spans_blocks(self):
+        # ブロックより大きい要求も足りない分を継ぎ足して返す
+        values = self.pool.standard_normal(1000)
+        self.assertEqual(len(values), 1000)
+        self.assertEqual(len(np.unique(values)), 1000)
+        self.assertLess(abs(values.mean()), 0.2)
+        self.assertLess(abs(values.std() - 1), 0.2)
+
+    def test_normal_scale(self):
+        values = self.pool.normal(10, 0.001, size=100)
+        self.assertTrue(np.all(np.abs(values - 10) < 0.01))
+
+    def test_stop(self):
+        self.pool.stop()
+        self.assertFalse(self.pool._thread.is_alive())
+        # 止めた後もメインスレッドで作って返す
+        self.assertEqual(len(self.pool.random(500)), 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+"""
+scatter_coreの単体テスト Blenderなしで動く
+python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "lib"))
+import standalone  # noqa: E402
+
+core = standalone.load("scatter_core")
+
+
+class TestGenerateOffsets(unittest.TestCase):
+    def test_shape_and_scale(self):
+        for distribution, _, _ in core.DISTRIBUTIONS:
+            offsets = core.generate_offsets(distribution, 500, 2.0, core.get_rng(0))
+            self.assertEqual(offsets.shape, (500, 3))
+            if distribution != "GAUSS":
+                self.assertLessEqual(np.abs(offsets).max(), 2.0 + 1e-9)
+
+    def test_planar_distributions(self):
+        for distribution in ("DISC", "RING"):
+            offsets = core.generate_offsets(distribution, 200, 1.0, core.get_rng(0))
+            self.assertTrue(np.all(offsets[:, 2] == 0))
+        radius = np.linalg.norm(
+            core.generate_offsets("RING", 200, 1.0, core.get_rng(0), inner=0.5), axis=1
+        )
+        self.assertTrue(np.all((radius >= 0.5 - 1e-9) & (radius <= 1.0 + 1e-9)))
+
+    def test_seed_is_reproducible(self):
+        a = core.generate_offsets("SPHERE", 10, 1.0, core.get_rng(3))
+        b = core.generate_offsets("SPHERE", 10, 1.0, core.get_rng(3))
+        np.testing.assert_array_equal(a, b)
+
+    def test_shared_rng(self):
+        self.assertIs(core.get_rng(), core.get_rng())
+        self.assertEqual(core.generate_offsets("GAUSS", 1).shape, (1, 3))
+
+    def test_unknown_distribution(self):
+        with self.assertRaises(ValueError):
+            core.generate_offsets("NOPE", 1)
+
+
+class TestResamplePolyline(unittest.TestCase):
+    def test_spacing(self):
+        points = [(0, 0, 0), (1, 0, 0), (1, 1, 0)]
+        positions, pressures, carry = core.resample_polyline(
+            points, [0.0, 1.0, 1.0], 0.25
+        )
+        self.assertEqual(len(positions), 8)
+        steps = np.linalg.norm(np.diff(positions, axis=0), axis=1)
+        # 角をまたぐ区間だけ直線距離が短くなる
+        self.assertTrue(np.all(steps <= 0.25 + 1e-9))
+        np.testing.assert_allclose(positions[0], (0.25, 0, 0))
+        np.testing.assert_allclose(pressures[:3], (0.25, 0.5, 0.75))
+        self.assertAlmostEqual(carry, 0.0)
+
+    def test_carry_over_calls(self):
+        # 2回に分けて渡しても1回で渡したのと同じ位置になる
+        whole, _, _ = core.resample_polyline([(0, 0, 0), (1, 0, 0)], [1, 1], 0.3)
+        first, _, carry = core.resample_polyline([(0, 0, 0), (0.5, 0, 0)], [1, 1], 0.3)
+        second, _, _ = core.resample_polyline(
+            [(0.5, 0, 0), (1, 0, 0)], [1, 1], 0.3, carry
+        )
+        np.testing.assert_allclose(np.concatenate([first, second]), whole)
+
+    def test_short_and_degenerate(self):
+        positions, _, carry = core.resample_polyline(
+            [(0, 0, 0), (0.1, 0, 0)], [1, 1], 1
+        )
+        self.assertEqual(len(positions), 0)
+        self.assertAlmostEqual(carry, 0.1)
+        positions, _, _ = core.resample_polyline(
+            [(0, 0, 0), (0, 0, 0), (1, 0, 0)], [1, 1, 1], 0.5
+        )
+        self.assertEqual(len(positions), 2)
+
+
+class TestUnprojectToPlane(unittest.TestCase):
+    def test_identity_view(self):
+        ndc = np.array([(0.0, 0.0), (0.5, -0.25)])
+        points = core.unproject_to_plane(ndc, np.eye(4), (0, 0, 0.2), (0, 0, 1))
+        np.testing.assert_allclose(points, [(0, 0, 0.2), (0.5, -0.25, 0.2)])
+
+    def test_round_trip_with_projection(self):
+        # z軸の負の向きを見る透視投影
+        near, far = 0.1, 100.0
+        perspective = np.array(
+            [
+                [1, 0, 0, 0],
+                [0, 1, 0, 0],
+                [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                [0, 0, -1, 0],
+            ],
+            dtype=np.float64,
+        )
+        points = np.array([(0.3, -0.2, -5.0), (-1.0, 0.5, -5.0)])
+        coords, visible = core.project_to_region(points, perspective, 200, 100)
+        self.assertTrue(visible.all())
+        ndc = core.region_to_ndc(coords, 200, 100)
+        result = core.unproject_to_plane(
+            ndc, np.linalg.inv(perspective), (0, 0, -5.0), (0, 0, 1)
+        )
+        np.testing.assert_allclose(result, points, atol=1e-9)
+
+
+class TestRayBoxMask(unittest.TestCase):
+    def test_hits_and_misses(self):
+        origins = np.array(
+            [(0, 0, -5), (3, 0, -5), (0, 0, 5), (0, 0, -5), (1, 0.5, -5)],
+            dtype=np.float64,
+        )
+        directions = np.array(
+            [(0, 0, 1), (0, 0, 1), (0, 0, 1), (0.1, 0, 1), (0, 0, 1)],
+            dtype=np.float64,
+        )
+        mask = core.ray_box_mask(origins, directions, (-1, -1, -1), (1, 1, 1))
+        # 4本目は斜めに入る 5本目は始点が箱の面の延長上にある
+        self.assertEqual(mask.tolist(), [True, False, False, True, True])
+
+    def test_origin_inside(self):
+        mask = core.ray_box_mask([(0, 0, 0)], [(1, 0, 0)], (-1, -1, -1), (1, 1, 1))
+        self.assertTrue(mask.all())
+
+
+class TestGridCells(unittest.TestCase):
+    def test_cells(self):
+        points = [(0.01, 0, 0), (0.02, 0, 0), (0.5, 0, 0), (0.03, 0.01, 0)]
+        first, inverse = core.grid_cells(points, 0.1)
+        self.assertEqual(sorted(first.tolist()), [0, 2])
+        self.assertEqual(len(set(inverse[[0, 1, 3]].tolist())), 1)
+
+    def test_groups_do_not_share_cells(self):
+        points = [(0.01, 0, 0), (0.02, 0, 0), (0.01, 0, 0), (0.02, 0, 0)]
+        first, inverse = core.grid_cells(points, 0.1, groups=[0, 0, 1, 1])
+        self.assertEqual(sorted(first.tolist()), [0, 2])
+        self.assertNotEqual(inverse[0], inverse[2])
+
+
+class TestSpatialHash(unittest.TestCase):
+    def test_min_distance(self):
+        points = np.random.default_rng(0).uniform(0, 1, (2000, 3))
+        spatial_hash = core.SpatialHash(0.1)
+        accepted = points[spatial_hash.insert(points)]
+        self.assertEqual(len(spatial_hash), len(accepted))
+        distance = np.linalg.norm(accepted[:, None] - accepted[None], axis=2)
+        np.fill_diagonal(distance, np.inf)
+        self.assertGreaterEqual(distance.min(), 0.1)
+
+    def test_keeps_previous_points(self):
+        spatial_hash = core.SpatialHash(1.0)
+        self.assertTrue(spatial_hash.insert([(0, 0, 0)]).all())
+        self.assertFalse(spatial_hash.insert([(0.5, 0, 0)]).any())
+        self.assertTrue(spatial_hash.insert([(1.5, 0, 0)]).all())
+
+    def test_max_per_cell(self):
+        spatial_hash = core.SpatialHash(0.01, max_per_cell=1)
+        accepted = spatial_hash.insert([(0.001, 0, 0), (0.009, 0, 0)])
+        self.assertEqual(accepted.tolist(), [True, False])
+
+    def test_invalid_distance(self):
+        with self.assertRaises(ValueError):
+            core.SpatialHash(0)
+
+    def test_matches_sequential_insert(self):
+        # 1点ずつ順に採用していったのと同じ結果になる
+        def sequential(batches, min_distance, max_per_cell):
+            kept, cells, masks = [], {}, []
+            for batch in batches:
+                mask = []
+                for p in batch:
+                    cell = tuple(np.floor(p / min_distance).astype(int))
+                    ok = not (max_per_cell and cells.get(cell, 0) >= max_per_cell)
+                    ok = ok and all(
+                        np.sum((p - q) ** 2) >= min_distance**2 for q in kept
+                    )
+                    if ok:
+                        kept.append(p)
+                        cells[cell] = cells.get(cell, 0) + 1
+                    mask.append(ok)
+                masks.append(mask)
+            return masks
+
+        rng = np.random.default_rng(1)
+        for max_per_cell in (0, 1, 2):
+            batches = [rng.normal(0, 0.2, (150, 3)) for _ in range(3)]
+            batches.append(np.round(batches[0], 1))
+            spatial_hash = core.SpatialHash(0.1, max_per_cell)
+            masks = [spatial_hash.insert(batch).tolist() for batch in batches]
+            self.assertEqual(masks, sequential(batches, 0.1, max_per_cell))
+
+    def test_far_cells(self):
+        # セル座標が2**21を超えて折り返しても別の点として扱う
+        spatial_hash = core.SpatialHash(1.0)
+        accepted = spatial_hash.insert([(0.5, 0, 0), (2**21 + 0.5, 0, 0)])
+        self.assertTrue(accepted.all())
+        self.assertFalse(spatial_hash.insert([(2**21 + 0.7, 0, 0)]).any())
+
+    def test_tick_batch_is_fast(self):
+        # 1tickぶんの1000点がtick_budgetの既定値(8ms)より十分短く済む
+        spatial_hash = core.SpatialHash(0.01)
+        for seed in range(10):
+            spatial_hash.insert(
+                core.generate_offsets("GAUSS", 1000, 1.0, core.get_rng(seed))
+            )
+        times = []
+        for seed in range(10, 15):
+            points = core.generate_offsets("GAUSS", 1000, 1.0, core.get_rng(seed))
+            start = time.perf_counter()
+            spatial_hash.insert(points)
+            times.append(time.perf_counter() - start)
+        self.assertLess(min(times), 0.004)
+
+
+class TestStagingBuffer(unittest.TestCase):
+    def test_grows(self):
+        buffer = core.StagingBuffer(capacity=4)
+        for i in range(5):
+            buffer.append(np.full((3, 3), i), np.ones(3), np.ones(3))
+        self.assertEqual(len(buffer), 15)
+        self.assertGreaterEqual(buffer.capacity, 15)
+        self.assertEqual(buffer.co[::3, 0].tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(buffer.pressure.shape, (15,))
+
+    def test_color(self):
+        buffer = core.StagingBuffer()
+        buffer.append(np.zeros((2, 3)), np.ones(2), np.ones(2))
+        self.assertFalse(buffer.use_color)
+        buffer.append(np.zeros((1, 3)), np.ones(1), np.ones(1), np.ones((1, 4)))
+        self.assertTrue(buffer.use_color)
+        # 色なしで追加した分は0になる
+        self.assertEqual(buffer.vertex_color[:, 0].tolist(), [0, 0, 1])
+
+    def test_clear_keeps_capacity(self):
+        buffer = core.StagingBuffer(capacity=2)
+        buffer.append(np.zeros((10, 3)), np.ones(10), np.ones(10), np.ones((10, 4)))
+        capacity, version = buffer.capacity, buffer.version
+        buffer.clear()
+        self.assertEqual(len(buffer), 0)
+        self.assertFalse(buffer.use_color)
+        self.assertEqual(buffer.capacity, capacity)
+        self.assertGreater(buffer.version, version)
+
+    def test_empty_append(self):
+        buffer = core.StagingBuffer()
+        version = buffer.version
+        buffer.append(np.zeros((0, 3)), np.zeros(0), np.zeros(0))
+        self.assertEqual(buffer.version, version)
+
+
+if __name__ == "__main__":
+    unittest.main()
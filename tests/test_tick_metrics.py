@@ -0,0 +1,68 @@
+"""
+tick_metricsの単体テスト Blenderなしで動く
+python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "lib"))
+import standalone  # noqa: E402
+
+tick_metrics = standalone.load("tick_metrics")
+
+
+def row(value: float, interval: float = 0.1) -> tuple:
+    values = [value] * len(tick_metrics.FIELDS)
+    values[tick_metrics.FIELDS.index("interval")] = interval
+    return tuple(values)
+
+
+class TestTickMetrics(unittest.TestCase):
+    def test_ring_buffer(self):
+        metrics = tick_metrics.TickMetrics(capacity=3)
+        for i in range(5):
+            metrics.record(row(i))
+        self.assertEqual(len(metrics), 3)
+        self.assertEqual(metrics.total_ticks, 5)
+        # 古い順に残っている
+        self.assertEqual(metrics.rows()[:, 0].tolist(), [2, 3, 4])
+
+    def test_summary(self):
+        metrics = tick_metrics.TickMetrics(requested_rate=10)
+        metrics.record(row(0, interval=0))
+        for i in range(1, 101):
+            metrics.record(row(i))
+        summary = metrics.summary()
+        self.assertEqual(summary["ticks"], 101)
+        self.assertEqual(summary["requested_rate"], 10)
+        self.assertEqual(summary["total"]["p50"], 50)
+        self.assertEqual(summary["total"]["max"], 100)
+        self.assertAlmostEqual(summary["total"]["p95"], 95)
+        # 最初のティックの間隔0は除く
+        self.assertAlmostEqual(summary["actual_rate"], 10)
+
+    def test_empty_summary(self):
+        summary = tick_metrics.TickMetrics().summary()
+        self.assertEqual(summary["ticks"], 0)
+        self.assertNotIn("total", summary)
+
+    def test_dump(self):
+        metrics = tick_metrics.TickMetrics()
+        metrics.record(row(1.5))
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "metrics.json")
+            metrics.dump(filepath)
+            with open(filepath) as f:
+                data = json.load(f)
+        self.assertEqual(data["fields"], list(tick_metrics.FIELDS))
+        np.testing.assert_allclose(data["rows"], [row(1.5)])
+        self.assertEqual(data["summary"]["total"]["p50"], 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
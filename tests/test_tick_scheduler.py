@@ -0,0 +1,63 @@
+"""
+tick_schedulerの単体テスト Blenderなしで動く
+python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "lib"))
+import standalone  # noqa: E402
+
+tick_scheduler = standalone.load("tick_scheduler")
+
+
+class TestTickScheduler(unittest.TestCase):
+    def test_initial_count(self):
+        scheduler = tick_scheduler.TickScheduler(0.008, 1000, 0.1)
+        self.assertEqual(scheduler.count, 100)
+        self.assertEqual(scheduler.interval, 0.1)
+        self.assertAlmostEqual(scheduler.achieved_points_per_second, 1000)
+
+    def test_within_budget_keeps_interval(self):
+        scheduler = tick_scheduler.TickScheduler(0.008, 1000, 0.1)
+        # 1点1µsなら100点で0.1msなので予算に収まる
+        scheduler.update(0.0001, 100)
+        self.assertEqual(scheduler.count, 100)
+        self.assertEqual(scheduler.interval, 0.1)
+
+    def test_over_budget_splits_ticks(self):
+        scheduler = tick_scheduler.TickScheduler(0.008, 1000, 0.1)
+        # 1点0.2msだと予算内で置けるのは40点 間隔を詰めて密度を保つ
+        scheduler.update(0.02, 100)
+        self.assertEqual(scheduler.count, 40)
+        self.assertAlmostEqual(scheduler.interval, 0.04)
+        self.assertAlmostEqual(scheduler.achieved_points_per_second, 1000)
+
+    def test_min_interval_limits_density(self):
+        scheduler = tick_scheduler.TickScheduler(0.001, 100000, 0.1, min_interval=0.01)
+        scheduler.update(0.01, 100)
+        self.assertEqual(scheduler.count, 10)
+        self.assertEqual(scheduler.interval, 0.01)
+        self.assertLess(scheduler.achieved_points_per_second, 100000)
+
+    def test_cost_is_smoothed(self):
+        scheduler = tick_scheduler.TickScheduler(0.008, 1000, 0.1, smoothing=0.5)
+        scheduler.update(0.001, 100)
+        scheduler.update(0.003, 100)
+        self.assertAlmostEqual(scheduler.cost_per_point, 0.00002)
+
+    def test_ignores_empty_ticks(self):
+        scheduler = tick_scheduler.TickScheduler(0.008, 1000, 0.1)
+        scheduler.update(0.01, 0)
+        self.assertEqual(scheduler.cost_per_point, 0.0)
+        self.assertEqual(scheduler.count, 100)
+
+    def test_should_reset_timer(self):
+        scheduler = tick_scheduler.TickScheduler(0.008, 1000, 0.1)
+        self.assertFalse(scheduler.should_reset_timer(0.11))
+        self.assertTrue(scheduler.should_reset_timer(0.2))
+
+
+if __name__ == "__main__":
+    unittest.main()